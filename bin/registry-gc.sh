@@ -0,0 +1,12 @@
+#!/bin/sh
+# Runs garbage collection on the registry container from docker-compose.yml
+# Invoked by `manage.py registry_gc` once pushes have been frozen and drained
+#
+# Invoke as bin/registry-gc.sh
+#
+# On timeout, registry_gc kills this script and the docker client, but not
+# what runs inside the container, so garbage collection enforces the
+# window's deadline itself, passed in REGISTRY_GC_TIMEOUT_SECONDS
+
+exec docker exec registry timeout "${REGISTRY_GC_TIMEOUT_SECONDS:-3600}" \
+    bin/registry garbage-collect --delete-untagged /etc/docker/registry/config.yml
@@ -0,0 +1 @@
+default_app_config = "dockient.dockerauth.apps.AuthConfig"
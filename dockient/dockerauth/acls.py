@@ -27,7 +27,7 @@ class Rule:
     def matches(self, request):
         pass
 
-    def allowed_actions(self):
+    def allowed_actions(self, request):
         pass
 
 
@@ -42,7 +42,7 @@ class ACL:
     def resolve(self, request):
         for rule in self.rules:
             if rule.matches(request):
-                return rule.allowed_actions()
+                return rule.allowed_actions(request)
         return DENY
 
 
@@ -75,6 +75,30 @@ class NamespaceAccess(Rule):
             return DENY
 
 
+class RobotScope(Rule):
+    """ Robot accounts can only act within their fixed scope
+
+    The robot is loaded along with the user by AuthToken.objects.authenticate,
+    so this does not query the database.
+    """
+
+    def matches(self, request):
+        return robot_of(request.user) is not None
+
+    def allowed_actions(self, request):
+        robot = robot_of(request.user)
+        if request.tipe != "repository" or not robot.can_access(request.namespace):
+            return DENY
+        if robot.scope_action == "push":
+            return COMPLETE_ACCESS
+        return set(["pull"])
+
+
+def robot_of(user):
+    # user.robot raises an AttributeError for regular and anonymous users
+    return getattr(user, "robot", None)
+
+
 class BackdoorAccess(Rule):
     def __init__(self, admins):
         self.admins = set(admins)
@@ -83,5 +107,5 @@ class BackdoorAccess(Rule):
         if request.account in self.admins:
             return True
 
-    def allowed_actions(self):
+    def allowed_actions(self, request):
         return set(["*"])
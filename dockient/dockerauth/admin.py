@@ -1,3 +1,303 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .models import (
+    AuthToken,
+    Namespace,
+    NamespaceAccessRule,
+    RobotAccount,
+    UserSummary,
+    WebhookDelivery,
+    WebhookSubscription,
+)
+
+import json
+
+# Below this many (estimated) rows, an exact COUNT(*) is cheap enough
+EXACT_COUNT_THRESHOLD = 10000
+
+# Query string parameter holding the primary key to continue paging from
+KEYSET_VAR = "before"
+
+# Max number of users or namespaces matched by a prefix in a search
+MAX_SEARCH_RELATED = 100
+
+
+def estimated_count(queryset):
+    """Returns the planner's estimate of the rows in `queryset`, or None
+
+    Only postgres exposes estimates, via EXPLAIN. Unlike COUNT(*), this does not
+    scan the table, so it is constant time even with millions of rows.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+def _int_or_none(value):
+    # An invalid position shows the first page
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+            return estimate
+        return super().count
+
+
+class KeysetChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = list(self.result_list)
+        self.keyset_active = request.keyset_before is not None
+
+    @property
+    def first_page_query(self):
+        return self.get_query_string(remove=[PAGE_VAR])
+
+    @property
+    def next_page_query(self):
+        if len(self.result_list) < self.list_per_page:
+            return None
+        last = self.result_list[-1]
+        return self.get_query_string({KEYSET_VAR: last.pk}, [PAGE_VAR])
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Admin that stays responsive on tables with millions of rows
+
+    - Counts are estimated by the query planner instead of a COUNT(*)
+    - Pages are fetched with `WHERE pk < last_seen ORDER BY pk DESC`,
+      instead of an OFFSET that scans every skipped row
+    - Searches use exact and prefix lookups, which can be answered from indexes
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ("-pk",)
+    sortable_by = ()
+    change_list_template = "admin/dockerauth/keyset_change_list.html"
+
+    # Fields searched with = and startswith respectively
+    exact_search_fields = ()
+    prefix_search_fields = ()
+
+    def changelist_view(self, request, extra_context=None):
+        # The admin rejects unknown query parameters,
+        # so take the keyset position out before the changelist sees it
+        request.GET = request.GET.copy()
+        request.keyset_before = _int_or_none(request.GET.pop(KEYSET_VAR, [None])[-1])
+        return super().changelist_view(request, extra_context)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        before = getattr(request, "keyset_before", None)
+        if before is not None:
+            queryset = queryset.filter(pk__lt=before)
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(self.search_condition(search_term)), False
+
+    def search_condition(self, search_term):
+        condition = Q()
+        for field in self.exact_search_fields:
+            condition |= Q(**{field: search_term})
+        for field in self.prefix_search_fields:
+            condition |= Q(**{field + "__startswith": search_term})
+        return condition
+
+    def get_search_fields(self, request):
+        # Only used by the admin to decide whether to show the search box,
+        # the actual lookups are in search_condition
+        return ("pk",)
+
+
+def related_with_prefix(field, model, lookup, search_term):
+    # Resolving the related rows first lets postgres combine the indexes on
+    # the searched table with a BitmapOr, instead of joining the related table
+    pks = model.objects.filter(**{lookup + "__startswith": search_term})
+    return Q(
+        **{field + "__in": list(pks.values_list("pk", flat=True)[:MAX_SEARCH_RELATED])}
+    )
+
+
+def users_with_prefix(search_term):
+    return related_with_prefix("user", get_user_model(), "username", search_term)
+
+
+@admin.register(AuthToken)
+class AuthTokenAdmin(ScalableAdmin):
+    list_display = ("id", "user", "access_key", "created_at", "expires_at")
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    exclude = ("secret_access_key",)
+    readonly_fields = ("access_key", "created_at")
+    exact_search_fields = ("access_key",)
+    actions = ["revoke"]
+
+    def search_condition(self, search_term):
+        return super().search_condition(search_term) | users_with_prefix(search_term)
+
+    def has_add_permission(self, request):
+        # Tokens are only created through get_docker_login
+        return False
+
+    def revoke(self, request, queryset):
+        # A single UPDATE, regardless of how many tokens are selected
+        active = queryset.filter(expires_at__gt=timezone.now())
+        with transaction.atomic():
+            UserSummary.objects.tokens_changed(active.values("user_id"))
+            revoked = active.update(expires_at=timezone.now())
+        self.message_user(request, "Revoked %s tokens" % revoked, messages.SUCCESS)
+
+    revoke.short_description = "Revoke selected tokens"
+
+
+@admin.register(Namespace)
+class NamespaceAdmin(ScalableAdmin):
+    list_display = ("id", "name", "owner")
+    list_select_related = ("owner",)
+    raw_id_fields = ("owner",)
+    prefix_search_fields = ("name",)
+
+
+@admin.register(NamespaceAccessRule)
+class NamespaceAccessRuleAdmin(ScalableAdmin):
+    list_display = ("id", "namespace", "user", "action")
+    list_select_related = ("namespace", "user")
+    list_filter = ("action",)
+    raw_id_fields = ("namespace", "user")
+    actions = ["revoke", "downgrade_to_pull"]
+
+    def search_condition(self, search_term):
+        return related_with_prefix(
+            "namespace", Namespace, "name", search_term
+        ) | users_with_prefix(search_term)
+
+    def revoke(self, request, queryset):
+        # Bypasses the delete confirmation page. The summaries of the affected
+        # users are recomputed when next read, so the post_delete handler of
+        # each rule finds no summary left to update
+        with transaction.atomic():
+            UserSummary.objects.filter(user__in=queryset.values("user_id")).delete()
+            revoked, _ = queryset.delete()
+        self.message_user(
+            request, "Revoked %s access rules" % revoked, messages.SUCCESS
+        )
+
+    revoke.short_description = "Revoke selected access rules"
+
+    def downgrade_to_pull(self, request, queryset):
+        updated = queryset.exclude(action="pull").update(action="pull")
+        self.message_user(
+            request, "Downgraded %s access rules" % updated, messages.SUCCESS
+        )
+
+    downgrade_to_pull.short_description = "Downgrade selected rules to pull only"
+
+
+@admin.register(RobotAccount)
+class RobotAccountAdmin(ScalableAdmin):
+    list_display = ("id", "name", "namespace", "scope_action", "scope_namespaces")
+    list_select_related = ("namespace",)
+    raw_id_fields = ("user", "namespace")
+    prefix_search_fields = ("name",)
+
+    def has_add_permission(self, request):
+        # Robots are created with the create_robot_credentials command
+        return False
+
+
+@admin.register(WebhookSubscription)
+class WebhookSubscriptionAdmin(ScalableAdmin):
+    list_display = ("id", "namespace", "url", "active")
+    list_select_related = ("namespace",)
+    raw_id_fields = ("namespace",)
+
+    def search_condition(self, search_term):
+        return related_with_prefix("namespace", Namespace, "name", search_term)
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(ScalableAdmin):
+    list_display = (
+        "id",
+        "subscription",
+        "repository",
+        "tag",
+        "status",
+        "attempts",
+        "next_attempt_at",
+    )
+    list_filter = ("status",)
+    raw_id_fields = ("subscription",)
+    prefix_search_fields = ("repository",)
+    actions = ["retry_now"]
+
+    def retry_now(self, request, queryset):
+        # Only one delivery per tag can be pending. A failed delivery whose tag
+        # has a pending one is superseded by it, which is retried instead, and
+        # of several failed deliveries of a tag only the latest is retried
+        pending = WebhookDelivery.objects.filter(
+            status=WebhookDelivery.PENDING,
+            subscription=OuterRef("subscription"),
+            repository=OuterRef("repository"),
+            tag=OuterRef("tag"),
+        ).exclude(pk=OuterRef("pk"))
+        selected = (
+            queryset.exclude(status=WebhookDelivery.DELIVERED)
+            .annotate(superseded=Exists(pending))
+            .order_by("-pk")
+            .values_list("pk", "subscription_id", "repository", "tag", "superseded")
+        )
+        retried = {}
+        superseded = Q(pk__in=[])
+        for pk, subscription_id, repository, tag, has_pending in selected:
+            key = (subscription_id, repository, tag)
+            if has_pending:
+                superseded |= Q(
+                    status=WebhookDelivery.PENDING,
+                    subscription_id=subscription_id,
+                    repository=repository,
+                    tag=tag,
+                )
+            else:
+                retried.setdefault(key, pk)
+
+        now = timezone.now()
+        with transaction.atomic():
+            updated = WebhookDelivery.objects.filter(pk__in=retried.values()).update(
+                status=WebhookDelivery.PENDING, next_attempt_at=now
+            )
+            updated += WebhookDelivery.objects.filter(superseded).update(
+                next_attempt_at=now
+            )
+        self.message_user(request, "Retrying %s deliveries" % updated, messages.SUCCESS)
+
+    retry_now.short_description = "Retry selected deliveries now"
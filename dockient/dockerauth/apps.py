@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class AuthConfig(AppConfig):
-    name = "dockerauth"
+    name = "dockient.dockerauth"
+
+    def ready(self):
+        # Connects the handlers that keep user summaries up to date
+        from . import summaries
@@ -0,0 +1,224 @@
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .models import TokenAuditLog
+from .writebehind import CONNECTION_ERRORS, WriteBehind
+
+import datetime
+import ipaddress
+import logging
+import queue
+import re
+
+logger = logging.getLogger(__name__)
+
+# On postgres, the audit log is partitioned by day on issued_at
+# Partitions are named dockerauth_tokenauditlog_pYYYYMMDD
+PARTITION_PREFIX = TokenAuditLog._meta.db_table + "_p"
+PARTITION_PATTERN = re.compile(re.escape(PARTITION_PREFIX) + r"(\d{8})$")
+# Holds entries issued on days without a partition, see create_partitions
+DEFAULT_PARTITION = TokenAuditLog._meta.db_table + "_default"
+
+
+class AuditLogWriter(WriteBehind):
+    """Records issued tokens without an INSERT on the request path
+
+    Entries are put on a bounded queue and written by a background thread
+    with a single bulk_create per batch. If the database falls behind and the
+    queue fills up, new entries are dropped and counted instead of blocking
+    the token service. Entries that cannot be written, while the database
+    is down, are queued again. Invalid entries are dropped and counted, so
+    that they don't hold back the rest of their batch.
+    """
+
+    def __init__(self, max_buffer, batch_size, interval):
+        super().__init__(interval)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.rejected = 0
+        self._queue = queue.Queue(maxsize=max_buffer)
+
+    def record(self, entry):
+        self._ensure_started()
+        if self._put(entry) and self._queue.qsize() >= self.batch_size:
+            self.wakeup()
+
+    def _put(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(
+                "Audit log buffer is full, dropped %s entries so far", self.dropped
+            )
+            return False
+
+    def _drain(self):
+        entries = []
+        while True:
+            try:
+                entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                return entries
+
+    def _write(self, entries):
+        try:
+            with transaction.atomic():
+                TokenAuditLog.objects.bulk_create(entries, batch_size=self.batch_size)
+        except CONNECTION_ERRORS:
+            # bulk_create is atomic, keep every entry for the next flush
+            for entry in entries:
+                self._put(entry)
+            raise
+        except DatabaseError:
+            # An invalid entry fails the whole batch, find it
+            self._write_each(entries)
+
+    def _write_each(self, entries):
+        for i, entry in enumerate(entries):
+            try:
+                with transaction.atomic():
+                    entry.save(force_insert=True)
+            except CONNECTION_ERRORS:
+                for remaining in entries[i:]:
+                    self._put(remaining)
+                raise
+            except DatabaseError:
+                # Not queued again, it would fail every later flush
+                self.rejected += 1
+                logger.exception("Dropped an invalid audit log entry %s", entry.jti)
+
+
+writer = AuditLogWriter(
+    max_buffer=settings.AUDIT_LOG_MAX_BUFFER,
+    batch_size=settings.AUDIT_LOG_BATCH_SIZE,
+    interval=lambda: settings.AUDIT_LOG_FLUSH_INTERVAL_SECONDS,
+)
+
+
+def record_token(jti, user, service, scope, actions, client_ip, iat, exp):
+    writer.record(
+        TokenAuditLog(
+            jti=jti,
+            user_id=user.id,
+            username=user.username,
+            service=service,
+            scope=scope,
+            granted_actions=",".join(actions),
+            client_ip=_valid_ip(client_ip),
+            issued_at=_from_timestamp(iat),
+            expires_at=_from_timestamp(exp),
+        )
+    )
+
+
+def create_partitions(days_ahead):
+    """Create daily partitions from today up to `days_ahead` days in the future
+
+    Returns the names of the partitions that were created. This is a no-op
+    on databases other than postgres, where the audit log is a plain table.
+
+    Entries issued on a day without a partition land in the default
+    partition. They are moved to the day's partition when it is created, as
+    postgres refuses to create a partition for rows the default one holds.
+    """
+    if connection.vendor != "postgresql":
+        return []
+    today = timezone.now().date()
+    existing = set(_list_partitions())
+    table = connection.ops.quote_name(TokenAuditLog._meta.db_table)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + datetime.timedelta(days=offset)
+        name = _partition_name(day)
+        if name in existing:
+            continue
+        bounds = [day.isoformat(), (day + datetime.timedelta(days=1)).isoformat()]
+        partition = connection.ops.quote_name(name)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS)".format(
+                    partition, table
+                )
+            )
+            cursor.execute(
+                "WITH moved AS (DELETE FROM {0} WHERE issued_at >= %s "
+                "AND issued_at < %s RETURNING *) "
+                "INSERT INTO {1} SELECT * FROM moved".format(default, partition),
+                bounds,
+            )
+            cursor.execute(
+                "ALTER TABLE {0} ATTACH PARTITION {1} "
+                "FOR VALUES FROM (%s) TO (%s)".format(table, partition),
+                bounds,
+            )
+        created.append(name)
+    return created
+
+
+def drop_expired(retention_days):
+    """Remove audit entries older than `retention_days`
+
+    On postgres, whole day partitions are dropped, which is a cheap catalog
+    operation regardless of how many rows they hold, and old rows left in the
+    default partition are deleted. Elsewhere, old rows are deleted. Returns
+    the names of the dropped partitions, or the number of deleted rows.
+    """
+    cutoff = timezone.now().date() - datetime.timedelta(days=retention_days)
+    if connection.vendor != "postgresql":
+        deleted, _ = TokenAuditLog.objects.filter(issued_at__date__lt=cutoff).delete()
+        return deleted
+
+    dropped = []
+    with connection.cursor() as cursor:
+        for name, day in _list_partitions().items():
+            if day < cutoff:
+                cursor.execute(
+                    "DROP TABLE IF EXISTS {0}".format(connection.ops.quote_name(name))
+                )
+                dropped.append(name)
+        cursor.execute(
+            "DELETE FROM {0} WHERE issued_at < %s".format(
+                connection.ops.quote_name(DEFAULT_PARTITION)
+            ),
+            [cutoff.isoformat()],
+        )
+    return dropped
+
+
+def _list_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = %s",
+            [TokenAuditLog._meta.db_table],
+        )
+        partitions = {}
+        for (name,) in cursor.fetchall():
+            matcher = PARTITION_PATTERN.match(name)
+            if matcher:
+                partitions[name] = datetime.datetime.strptime(
+                    matcher.group(1), "%Y%m%d"
+                ).date()
+        return partitions
+
+
+def _partition_name(day):
+    return PARTITION_PREFIX + day.strftime("%Y%m%d")
+
+
+def _from_timestamp(ts):
+    return datetime.datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+def _valid_ip(client_ip):
+    # An invalid address would make the whole batch fail on postgres
+    try:
+        return str(ipaddress.ip_address(client_ip))
+    except ValueError:
+        return None
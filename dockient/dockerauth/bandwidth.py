@@ -0,0 +1,214 @@
+"""Accounts for blob pulls per namespace from the nginx access log
+
+Blobs are served through the nginx /v2 location, so the access log, in the
+default combined format, is where pull volume shows up:
+
+    10.0.0.1 - - [19/Oct/2019:13:55:36 +0000] "GET /v2/team/app/blobs/sha256:...
+    HTTP/1.1" 200 52428800 "-" "docker/19.03.2"
+
+Logs are read as a pipeline of generators, so memory use does not depend on
+the size of the file:
+
+- LogReader yields complete lines, and tracks the offset after the last one
+- blob_pulls skips any line that is not a successful GET of a blob with
+  a substring search, and only then extracts the namespace, hour and bytes
+- ingest_file sums bytes and requests per namespace and hour in a dict, and
+  writes them with a few bulk queries per batch
+
+The offset reached is saved in the same transaction as the totals, so an
+interrupted ingestion resumes where it stopped without counting twice.
+"""
+from django.db import IntegrityError, transaction
+
+from .models import LogIngestOffset, Namespace, NamespaceBandwidth
+
+import datetime
+import functools
+import gzip
+import hashlib
+import os
+
+# Pending totals are written once there are this many namespace and hour pairs
+MAX_PENDING_TOTALS = 10000
+
+# Writing totals is retried when another node inserted the same rows first
+SAVE_ATTEMPTS = 3
+
+BLOB_GET = b'"GET /v2/'
+BLOBS = b"/blobs/"
+
+
+class LogReader:
+    """Yields complete lines of `f`, from `offset`
+
+    A last line without a newline is still being written, it is left for the
+    next run. `offset` is the position after the last line yielded.
+    """
+
+    def __init__(self, f, offset):
+        self.f = f
+        self.offset = offset
+        self.lines = 0
+
+    def __iter__(self):
+        for line in self.f:
+            if not line.endswith(b"\n"):
+                return
+            self.offset += len(line)
+            self.lines += 1
+            yield line
+
+
+def blob_pulls(lines):
+    """Yields (namespace, hour, bytes sent) for every successful blob GET
+
+    Repositories outside a namespace, like library images, are skipped.
+    """
+    for line in lines:
+        start = line.find(BLOB_GET)
+        if start < 0:
+            continue
+        start += len(BLOB_GET)
+        end = line.find(b" ", start)
+        blobs = line.find(BLOBS, start, end)
+        if blobs < 0:
+            continue
+        slash = line.find(b"/", start, blobs)
+        if slash < 0:
+            continue
+
+        # The status and the size follow the request line
+        status = line.find(b'" ', end) + 2
+        if line[status : status + 1] != b"2":
+            continue
+        size = line[status + 4 : line.find(b" ", status + 4)]
+
+        time = line.find(b"[", 0, start) + 1
+        # Like 19/Oct/2019:13 +0000, the minutes and seconds are left out
+        hour = _parse_hour(line[time : time + 14] + line[time + 20 : time + 26])
+        yield line[start:slash], hour, int(size) if size.isdigit() else 0
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_hour(text):
+    # Called for every line, but only parses each hour once
+    parsed = datetime.datetime.strptime(text.decode("ascii"), "%d/%b/%Y:%H %z")
+    return parsed.astimezone(datetime.timezone.utc)
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def ingest_file(path, max_pending=MAX_PENDING_TOTALS):
+    """Adds the blob pulls logged in `path` since the last run
+
+    Returns the number of lines read.
+    """
+    with _open(path) as f:
+        first_line = f.readline()
+        if not first_line.endswith(b"\n"):
+            return 0
+        fingerprint = hashlib.sha256(first_line).hexdigest()
+        state, _ = LogIngestOffset.objects.get_or_create(
+            fingerprint=fingerprint, defaults={"path": path}
+        )
+        if not path.endswith(".gz") and os.fstat(f.fileno()).st_size < state.offset:
+            # Truncated in place, like logrotate's copytruncate does
+            state.offset = 0
+        f.seek(state.offset)
+
+        reader = LogReader(f, state.offset)
+        totals = {}
+        for namespace, hour, size in blob_pulls(reader):
+            key = (namespace, hour)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [size, 1]
+                if len(totals) >= max_pending:
+                    _save(totals, state, path, reader.offset)
+                    totals = {}
+            else:
+                total[0] += size
+                total[1] += 1
+        _save(totals, state, path, reader.offset)
+        return reader.lines
+
+
+def ingest(paths):
+    """Ingests several logs, oldest first, returns the number of lines read
+
+    Rotated logs are recognised by their first line, so passing both the
+    current log and its rotations only reads what is new in each. Logs
+    deleted in the meantime, like the oldest rotation, are skipped.
+    """
+    modified = []
+    for path in paths:
+        try:
+            modified.append((os.stat(path).st_mtime, path))
+        except FileNotFoundError:
+            continue
+    lines = 0
+    for _, path in sorted(modified):
+        try:
+            lines += ingest_file(path)
+        except FileNotFoundError:
+            continue
+    return lines
+
+
+def _save(totals, state, path, offset):
+    for attempt in range(SAVE_ATTEMPTS):
+        try:
+            return _save_once(totals, state, path, offset)
+        except IntegrityError:
+            # Another node created some of the namespace and hour rows after
+            # they were looked up, they are found and updated on the next try
+            if attempt == SAVE_ATTEMPTS - 1:
+                raise
+
+
+def _save_once(totals, state, path, offset):
+    with transaction.atomic():
+        names = set(namespace.decode("utf-8", "replace") for namespace, _ in totals)
+        ids = dict(Namespace.objects.filter(name__in=names).values_list("name", "id"))
+        pending = {}
+        for (namespace, hour), total in totals.items():
+            namespace_id = ids.get(namespace.decode("utf-8", "replace"))
+            if namespace_id is not None:
+                pending[(namespace_id, hour)] = total
+
+        if pending:
+            # A superset of the existing rows, the rest is filtered here
+            candidates = NamespaceBandwidth.objects.select_for_update().filter(
+                namespace_id__in=set(namespace_id for namespace_id, _ in pending),
+                hour__in=set(hour for _, hour in pending),
+            )
+            existing = [
+                row for row in candidates if (row.namespace_id, row.hour) in pending
+            ]
+            for row in existing:
+                size, requests = pending.pop((row.namespace_id, row.hour))
+                row.bytes_sent += size
+                row.requests += requests
+            NamespaceBandwidth.objects.bulk_update(
+                existing, ["bytes_sent", "requests"], batch_size=500
+            )
+            NamespaceBandwidth.objects.bulk_create(
+                [
+                    NamespaceBandwidth(
+                        namespace_id=namespace_id,
+                        hour=hour,
+                        bytes_sent=size,
+                        requests=requests,
+                    )
+                    for (namespace_id, hour), (size, requests) in pending.items()
+                ],
+                batch_size=500,
+            )
+
+        state.path = path
+        state.offset = offset
+        state.save(update_fields=["path", "offset", "updated_at"])
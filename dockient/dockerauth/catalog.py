@@ -0,0 +1,82 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Namespace, Repository, Tag
+
+
+def record_pushes(pushes):
+    """Records pushed tags, as extracted by webhooks.tag_pushes
+
+    Pushes to repositories outside a known namespace are ignored.
+    Returns the number of tags recorded.
+    """
+    pushes = [push for push in pushes if "/" in push["repository"]]
+    names = set(push["repository"].split("/", 1)[0] for push in pushes)
+    namespaces = Namespace.objects.in_bulk(names, field_name="name")
+
+    repositories = Repository.objects.in_bulk(
+        [push["repository"] for push in pushes], field_name="name"
+    )
+    recorded = 0
+    for push in pushes:
+        namespace = namespaces.get(push["repository"].split("/", 1)[0])
+        if namespace is None:
+            continue
+        repository = repositories.get(push["repository"])
+        if repository is None:
+            repository, _ = Repository.objects.get_or_create(
+                name=push["repository"], defaults={"namespace": namespace}
+            )
+            repositories[repository.name] = repository
+
+        Tag.objects.update_or_create(
+            repository=repository,
+            name=push["tag"],
+            defaults={
+                "digest": push["digest"] or "",
+                "size": push["size"],
+                "pushed_at": _parse_timestamp(push["pushed_at"]),
+            },
+        )
+        recorded += 1
+    return recorded
+
+
+def backfill(reader):
+    """Records the tags already in the registry, read with a RegistryReader
+
+    Repositories and tags are otherwise only recorded from push
+    notifications, so images pushed before dockient was notified of pushes
+    are missing until this runs once. Known tags are left as they are.
+    Returns the number of tags recorded.
+    """
+    recorded = 0
+    for repository in reader.repositories():
+        known = set(
+            Tag.objects.filter(repository__name=repository).values_list(
+                "name", flat=True
+            )
+        )
+        pushes = []
+        for tag in reader.tags(repository):
+            if tag in known:
+                continue
+            # The push time is unknown, tags count as pushed now
+            digest, size, _ = reader.manifest(repository, tag)
+            pushes.append(
+                {
+                    "repository": repository,
+                    "tag": tag,
+                    "digest": digest,
+                    "size": size,
+                    "pushed_at": None,
+                }
+            )
+        recorded += record_pushes(pushes)
+    return recorded
+
+
+def _parse_timestamp(timestamp):
+    # Like 2019-10-12T11:20:00.123456789Z, nanoseconds are truncated
+    parsed = parse_datetime(timestamp) if timestamp else None
+    return parsed or timezone.now()
@@ -0,0 +1,188 @@
+"""Serves token requests from a local snapshot when the database is down
+
+The refresh_token_snapshot command copies every active credential into a
+SQLite file on the node, DEGRADED_SNAPSHOT_FILE. Secrets are stored as
+sha256 hashes, along with the user and the scope of robot accounts, which
+is what the token service checks. The file is built aside and swapped in
+with a rename, so workers never read a partial snapshot, and it is memory
+mapped by every worker that reads it.
+
+When a token request fails with a DatabaseError, the token service
+authenticates against the snapshot instead, as long as it is no older than
+DEGRADED_MAX_STALENESS_SECONDS. The worker then keeps using the snapshot
+for DEGRADED_RETRY_SECONDS before trying the database again, so that
+requests don't each wait for the database to fail. Tokens issued in degraded mode only grant
+pull and expire after DEGRADED_TOKEN_EXPIRY_IN_SECONDS.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .models import AuthException, AuthToken, RobotAccount
+
+import contextlib
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+# Snapshots are small, map all of it
+MMAP_SIZE = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE credentials (
+    access_key TEXT PRIMARY KEY,
+    secret_sha256 BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    robot_scope TEXT,
+    robot_action TEXT
+);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+"""
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+class Status:
+    """Per worker counters, exposed by the metrics view"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.degraded = False
+        self.tokens_issued = 0
+        # time.monotonic() after which the database is tried again
+        self.retry_at = 0
+
+    def database_down(self):
+        self.retry_at = time.monotonic() + settings.DEGRADED_RETRY_SECONDS
+
+    def should_try_database(self):
+        return time.monotonic() >= self.retry_at
+
+    def fell_back(self):
+        with self.lock:
+            self.degraded = True
+            self.tokens_issued += 1
+
+    def recovered(self):
+        self.degraded = False
+
+
+status = Status()
+
+
+def refresh(path=None):
+    """Writes a new snapshot, returns the number of credentials in it"""
+    path = path or settings.DEGRADED_SNAPSHOT_FILE
+    if not path:
+        raise SnapshotUnavailable("DEGRADED_SNAPSHOT_FILE is not set")
+
+    rows = (
+        AuthToken.objects.filter(expires_at__gt=timezone.now())
+        .values_list(
+            "access_key",
+            "secret_access_key",
+            "expires_at",
+            "user_id",
+            "user__username",
+            "user__robot__scope_namespaces",
+            "user__robot__scope_action",
+        )
+        .iterator()
+    )
+    building = "%s.%s.tmp" % (path, os.getpid())
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(building)
+    count = 0
+    with contextlib.closing(sqlite3.connect(building)) as snapshot:
+        snapshot.execute("PRAGMA journal_mode = OFF")
+        snapshot.executescript(SCHEMA)
+        for access_key, secret, expires_at, *rest in rows:
+            snapshot.execute(
+                "INSERT INTO credentials VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [access_key, _hash(secret), expires_at.timestamp()] + rest,
+            )
+            count += 1
+        snapshot.execute("INSERT INTO meta VALUES ('created_at', ?)", [time.time()])
+        snapshot.commit()
+    os.replace(building, path)
+    return count
+
+
+def age():
+    """Seconds since the snapshot was taken, None if there is no snapshot"""
+    try:
+        with _connect() as snapshot:
+            return time.time() - _created_at(snapshot)
+    except SnapshotUnavailable:
+        return None
+
+
+def authenticate(access_key, secret_access_key):
+    """Like AuthToken.objects.authenticate, from the snapshot
+
+    Returns an unsaved user, with its robot account if it has one, so that
+    checking its scope does not query the database.
+    """
+    with _connect() as snapshot:
+        if (
+            time.time() - _created_at(snapshot)
+            > settings.DEGRADED_MAX_STALENESS_SECONDS
+        ):
+            raise SnapshotUnavailable("The credentials snapshot is too old")
+        row = snapshot.execute(
+            "SELECT secret_sha256, expires_at, user_id, username, robot_scope, "
+            "robot_action FROM credentials WHERE access_key = ?",
+            [access_key],
+        ).fetchone()
+
+    if row is None:
+        raise AuthException("Invalid credentials")
+    secret_sha256, expires_at, user_id, username, robot_scope, robot_action = row
+    if expires_at <= time.time() or not hmac.compare_digest(
+        secret_sha256, _hash(secret_access_key)
+    ):
+        raise AuthException("Invalid credentials")
+
+    user = get_user_model()(id=user_id, username=username)
+    robot = None
+    if robot_scope is not None:
+        robot = RobotAccount(
+            user_id=user_id, scope_namespaces=robot_scope, scope_action=robot_action
+        )
+    get_user_model().robot.related.set_cached_value(user, robot)
+    return user
+
+
+@contextlib.contextmanager
+def _connect():
+    path = settings.DEGRADED_SNAPSHOT_FILE
+    if not path:
+        raise SnapshotUnavailable("Degraded mode is disabled")
+    try:
+        snapshot = sqlite3.connect("file:%s?mode=ro" % path, uri=True)
+    except sqlite3.Error:
+        raise SnapshotUnavailable("There is no credentials snapshot")
+    try:
+        snapshot.execute("PRAGMA mmap_size = %d" % MMAP_SIZE)
+        yield snapshot
+    except sqlite3.Error as e:
+        raise SnapshotUnavailable("Cannot read the credentials snapshot: %s" % e)
+    finally:
+        snapshot.close()
+
+
+def _created_at(snapshot):
+    return snapshot.execute(
+        "SELECT value FROM meta WHERE key = 'created_at'"
+    ).fetchone()[0]
+
+
+def _hash(secret):
+    return hashlib.sha256(secret.encode("utf-8")).digest()
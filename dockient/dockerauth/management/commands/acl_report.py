@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth import policy
+
+import contextlib
+import csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the access of every user on every namespace as CSV, "
+        "or the changes since an earlier report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--diff",
+            metavar="BEFORE",
+            help="Earlier report to compare with, writes the changed access only",
+        )
+        parser.add_argument(
+            "--after",
+            metavar="AFTER",
+            help="Later report to compare BEFORE with, instead of the current policy",
+        )
+        parser.add_argument(
+            "--include-denied",
+            action="store_true",
+            help="Also report users without access, one row per user and namespace",
+        )
+
+    def handle(self, *args, **options):
+        if options["after"] and not options["diff"]:
+            raise CommandError("--after requires --diff")
+
+        with contextlib.ExitStack() as files:
+            if options["after"]:
+                after = policy.read_csv(
+                    files.enter_context(open(options["after"], newline=""))
+                )
+            else:
+                snapshot = policy.PolicySnapshot.load()
+                after = snapshot.rows(include_denied=options["include_denied"])
+
+            if not options["diff"]:
+                policy.write_csv(after, self.stdout)
+                return
+
+            before = policy.read_csv(
+                files.enter_context(open(options["diff"], newline=""))
+            )
+            writer = csv.writer(self.stdout)
+            writer.writerow(policy.DIFF_HEADER)
+            try:
+                writer.writerows(policy.diff(before, after))
+            except ValueError as e:
+                raise CommandError(str(e))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dockient.dockerauth import audit
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates upcoming daily partitions of the token audit log "
+        "and discards entries older than the retention period"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days", type=int, default=settings.AUDIT_LOG_RETENTION_DAYS
+        )
+        parser.add_argument("--days-ahead", type=int, default=7)
+
+    def handle(self, *args, **options):
+        for name in audit.create_partitions(options["days_ahead"]):
+            self.stdout.write("Created partition %s" % name)
+
+        dropped = audit.drop_expired(options["retention_days"])
+        if isinstance(dropped, int):
+            self.stdout.write("Deleted %s expired audit log entries" % dropped)
+        else:
+            for name in dropped:
+                self.stdout.write("Dropped partition %s" % name)
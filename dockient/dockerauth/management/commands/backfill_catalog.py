@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth import catalog, reclaim
+
+import urllib.error
+
+
+class Command(BaseCommand):
+    help = (
+        "Records the repositories and tags already in the registry, "
+        "which push notifications only report once pushed again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "registry", help="URL of the registry, like http://registry:5000"
+        )
+        parser.add_argument("--token", help="Bearer token to read the registry with")
+
+    def handle(self, *args, **options):
+        reader = reclaim.RegistryReader(options["registry"], token=options["token"])
+        try:
+            recorded = catalog.backfill(reader)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise CommandError("Cannot read the registry: %s" % e)
+        self.stdout.write("Recorded %d tags" % recorded)
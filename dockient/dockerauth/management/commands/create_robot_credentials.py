@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth.models import AuthToken, Namespace, RobotAccount
+
+import argparse
+import datetime
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return number
+
+
+class Command(BaseCommand):
+    help = (
+        "Issues credentials for a robot account, creating the robot if needed. "
+        "Prints one access_key:secret_access_key per line"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("namespace", help="Namespace that owns the robot")
+        parser.add_argument("name", help="Name of the robot")
+        parser.add_argument(
+            "--scope",
+            help="Comma separated namespaces a new robot can access, "
+            "defaults to the owning namespace",
+        )
+        parser.add_argument("--action", choices=("pull", "push"), default="pull")
+        parser.add_argument("--count", type=positive_int, default=1)
+        parser.add_argument("--expiry-days", type=int, default=365)
+
+    def handle(self, *args, **options):
+        try:
+            namespace = Namespace.objects.get(name=options["namespace"])
+        except Namespace.DoesNotExist:
+            raise CommandError("Unknown namespace " + options["namespace"])
+
+        try:
+            robot, created = self.get_or_create_robot(namespace, options)
+            credentials = AuthToken.objects.issue_robot_credentials(
+                robot, options["count"], datetime.timedelta(days=options["expiry_days"])
+            )
+        except Exception as e:
+            raise CommandError(str(e))
+
+        if created:
+            self.stderr.write("Created robot " + robot.user.username)
+        for access_key, secret_access_key in credentials:
+            self.stdout.write("%s:%s" % (access_key, secret_access_key))
+
+    def get_or_create_robot(self, namespace, options):
+        try:
+            robot = RobotAccount.objects.select_related("user").get(
+                namespace=namespace, name=options["name"]
+            )
+            return robot, False
+        except RobotAccount.DoesNotExist:
+            pass
+        if options["scope"]:
+            scope = options["scope"].split(",")
+        else:
+            scope = [namespace.name]
+        robot = RobotAccount.objects.create_robot(
+            namespace, options["name"], scope, options["action"]
+        )
+        return robot, True
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from dockient.dockerauth import webhooks
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Delivers queued webhooks, retrying failed deliveries with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once nothing is due"
+        )
+        parser.add_argument("--poll-interval", type=float, default=1)
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        dispatcher = webhooks.default_dispatcher()
+        try:
+            while True:
+                finished = dispatcher.poll(options["batch_size"])
+                if finished:
+                    self.stdout.write("Attempted %s deliveries" % finished)
+                if dispatcher.in_flight:
+                    # Wake up as soon as a slot frees up, or to start new ones
+                    dispatcher.wait(options["poll_interval"])
+                elif options["once"]:
+                    return
+                else:
+                    time.sleep(options["poll_interval"])
+        finally:
+            dispatcher.close()
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth import reclaim
+
+import urllib.error
+
+
+class Command(BaseCommand):
+    help = (
+        "Estimates the storage freed by expiring the matching tags, "
+        "counting layers shared with other images as kept"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "registry", help="URL of the registry, like http://registry:5000"
+        )
+        parser.add_argument(
+            "patterns",
+            nargs="*",
+            metavar="PATTERN",
+            help="Glob pattern on repository:tag, like team/*:pr-*",
+        )
+        parser.add_argument("--token", help="Bearer token to read the registry with")
+        parser.add_argument(
+            "--pushed-before",
+            type=int,
+            metavar="DAYS",
+            help="Only expire tags last pushed more than DAYS days ago",
+        )
+
+    def handle(self, *args, **options):
+        if not options["patterns"] and options["pushed_before"] is None:
+            raise CommandError("Give tag patterns, --pushed-before, or both")
+
+        reader = reclaim.RegistryReader(options["registry"], token=options["token"])
+        try:
+            graph = reclaim.build_graph(reader)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise CommandError("Cannot read the registry: %s" % e)
+
+        pushed_before = None
+        if options["pushed_before"] is not None:
+            pushed_before = reclaim.days_ago(options["pushed_before"])
+        tags = reclaim.select_tags(graph, options["patterns"], pushed_before)
+        estimate = graph.estimate(tags)
+
+        self.stdout.write(
+            "%d of %d tags expire, %d manifests and %d blobs are deleted"
+            % (estimate.tags, len(graph.tags), estimate.manifests, estimate.blobs)
+        )
+        self.stdout.write("Freed: %d bytes" % estimate.freed_bytes)
+        self.stdout.write("Shared with kept images: %d bytes" % estimate.shared_bytes)
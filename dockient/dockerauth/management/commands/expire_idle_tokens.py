@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth.models import AuthToken, token_usage
+
+
+class Command(BaseCommand):
+    help = "Expires tokens that have not been used for a number of days"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.TOKEN_IDLE_EXPIRY_DAYS,
+            help="Defaults to TOKEN_IDLE_EXPIRY_DAYS",
+        )
+
+    def handle(self, *args, **options):
+        if not options["days"]:
+            raise CommandError("Set TOKEN_IDLE_EXPIRY_DAYS or pass --days")
+        # Uses recorded by this process must count
+        token_usage.flush()
+        expired = AuthToken.objects.expire_idle(options["days"])
+        self.stdout.write("Expired %s idle tokens" % expired)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth import bandwidth
+
+import glob
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds the blob pulls of nginx access logs to the bandwidth of each "
+        "namespace. Only lines added since the last run are read"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "patterns",
+            nargs="+",
+            metavar="path",
+            help="Access logs, or glob patterns like /var/log/nginx/access.log*",
+        )
+        parser.add_argument(
+            "--follow",
+            type=int,
+            metavar="SECONDS",
+            help="Keep running, and read new lines every SECONDS",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            paths = set()
+            for pattern in options["patterns"]:
+                paths.update(glob.glob(pattern))
+            if not paths and not options["follow"]:
+                raise CommandError("No access log found")
+
+            lines = bandwidth.ingest(paths)
+            self.stdout.write("Read %s lines from %s files" % (lines, len(paths)))
+            if not options["follow"]:
+                return
+            time.sleep(options["follow"])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth import degraded
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies active credentials into DEGRADED_SNAPSHOT_FILE, which the token "
+        "service falls back to when the database is down. Run it on every node"
+    )
+
+    def handle(self, *args, **options):
+        try:
+            count = degraded.refresh()
+        except degraded.SnapshotUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write("Saved %s credentials to the snapshot" % count)
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dockient.dockerauth import registrygc
+from dockient.dockerauth.models import GarbageCollectionWindow
+
+
+class Command(BaseCommand):
+    help = (
+        "Freezes pushes, waits for in-flight pushes to drain, "
+        "runs registry garbage collection and lifts the freeze"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hook", default=settings.REGISTRY_GC_HOOK)
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=settings.REGISTRY_GC_TIMEOUT_IN_SECONDS,
+            help="Seconds after which pushes are allowed again, no matter what",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            window = registrygc.open_window(options["timeout"])
+        except registrygc.GarbageCollectionError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Pushes are frozen until %s" % window.deadline)
+
+        try:
+            registrygc.drain_pushes(window)
+            self.stdout.write("In-flight pushes drained, running garbage collection")
+            output = registrygc.run_hook(window, options["hook"])
+        except registrygc.GarbageCollectionTimeout as e:
+            registrygc.close_window(window, GarbageCollectionWindow.TIMED_OUT, str(e))
+            raise CommandError(str(e))
+        except Exception as e:
+            registrygc.close_window(window, GarbageCollectionWindow.FAILED, str(e))
+            raise CommandError(str(e))
+
+        registrygc.close_window(window, GarbageCollectionWindow.COMPLETED, output)
+        self.stdout.write("Garbage collection completed, pushes are allowed again")
@@ -0,0 +1,69 @@
+# Generated by Django 2.2.6 on 2026-10-19 10:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# On postgres, the audit log is recreated as a table partitioned by day
+# so that old entries can be discarded by dropping partitions.
+# The primary key of a partitioned table must include the partition key.
+# Rows that don't fall in any daily partition land in the default partition
+PARTITIONED_TABLE_SQL = """
+DROP TABLE dockerauth_tokenauditlog;
+CREATE TABLE dockerauth_tokenauditlog (
+    id bigserial NOT NULL,
+    jti varchar(64) NOT NULL,
+    username varchar(150) NOT NULL,
+    service varchar(255) NOT NULL,
+    scope text NOT NULL,
+    granted_actions varchar(100) NOT NULL,
+    client_ip inet NULL,
+    issued_at timestamp with time zone NOT NULL,
+    expires_at timestamp with time zone NOT NULL,
+    user_id integer NOT NULL,
+    PRIMARY KEY (id, issued_at)
+) PARTITION BY RANGE (issued_at);
+CREATE INDEX dockerauth_tokenauditlog_user_id ON dockerauth_tokenauditlog (user_id);
+CREATE INDEX dockerauth_tokenauditlog_issued_at ON dockerauth_tokenauditlog (issued_at);
+CREATE TABLE dockerauth_tokenauditlog_default
+    PARTITION OF dockerauth_tokenauditlog DEFAULT;
+"""
+
+
+def partition_audit_log(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(PARTITIONED_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("dockerauth", "0002_namespace_namespaceaccessrule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenAuditLog",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("jti", models.CharField(max_length=64)),
+                ("username", models.CharField(max_length=150)),
+                ("service", models.CharField(max_length=255)),
+                ("scope", models.TextField()),
+                ("granted_actions", models.CharField(max_length=100)),
+                ("client_ip", models.GenericIPAddressField(null=True)),
+                ("issued_at", models.DateTimeField(db_index=True)),
+                ("expires_at", models.DateTimeField()),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(partition_audit_log, migrations.RunPython.noop),
+    ]
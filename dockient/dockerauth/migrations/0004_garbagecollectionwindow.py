@@ -0,0 +1,43 @@
+# Generated by Django 2.2.6 on 2026-10-19 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("dockerauth", "0003_tokenauditlog")]
+
+    operations = [
+        migrations.CreateModel(
+            name="GarbageCollectionWindow",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("draining", "waiting for in-flight pushes"),
+                            ("collecting", "garbage collection running"),
+                            ("completed", "completed"),
+                            ("failed", "failed"),
+                            ("timed_out", "timed out"),
+                        ],
+                        default="draining",
+                        max_length=10,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(auto_now_add=True)),
+                ("deadline", models.DateTimeField()),
+                ("ended_at", models.DateTimeField(db_index=True, null=True)),
+                ("detail", models.TextField(blank=True)),
+            ],
+        )
+    ]
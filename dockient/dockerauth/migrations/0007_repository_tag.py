@@ -0,0 +1,73 @@
+# Generated by Django 2.2.6 on 2026-10-19 10:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# On postgres, repository names get a trigram index for substring search
+# The index is on UPPER(name::text), which is what icontains compares
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX dockerauth_repository_name_trgm ON dockerauth_repository "
+            "USING gin (UPPER(name::text) gin_trgm_ops)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("dockerauth", "0006_webhooks")]
+
+    operations = [
+        migrations.CreateModel(
+            name="Repository",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "namespace",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="dockerauth.Namespace",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=128)),
+                ("digest", models.CharField(max_length=100)),
+                ("size", models.BigIntegerField(null=True)),
+                ("pushed_at", models.DateTimeField()),
+                (
+                    "repository",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="dockerauth.Repository",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("repository", "name")}},
+        ),
+        migrations.RunPython(create_trigram_index, migrations.RunPython.noop),
+    ]
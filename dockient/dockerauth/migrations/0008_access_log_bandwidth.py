@@ -0,0 +1,55 @@
+# Generated by Django 2.2.6 on 2026-10-19 10:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("dockerauth", "0007_repository_tag")]
+
+    operations = [
+        migrations.CreateModel(
+            name="LogIngestOffset",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=64, unique=True)),
+                ("path", models.CharField(max_length=500)),
+                ("offset", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="NamespaceBandwidth",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField()),
+                ("bytes_sent", models.BigIntegerField(default=0)),
+                ("requests", models.BigIntegerField(default=0)),
+                (
+                    "namespace",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="dockerauth.Namespace",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("namespace", "hour")}},
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 2.2.6 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("dockerauth", "0008_access_log_bandwidth")]
+
+    operations = [
+        migrations.AddField(
+            model_name="authtoken",
+            name="last_used_at",
+            field=models.DateTimeField(blank=True, null=True),
+        )
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-19 11:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0011_update_proxy_permissions"),
+        ("dockerauth", "0009_authtoken_last_used_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("active_tokens", models.IntegerField(default=0)),
+                ("tokens_expire_at", models.DateTimeField(null=True)),
+                ("owned_namespaces", models.IntegerField(default=0)),
+                ("shared_namespaces", models.IntegerField(default=0)),
+                ("repositories", models.IntegerField(default=0)),
+                ("storage_bytes", models.BigIntegerField(default=0)),
+            ],
+        )
+    ]
@@ -0,0 +1,12 @@
+# Generated by Django 2.2.6 on 2026-10-19 11:22
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("dockerauth", "0010_usersummary")]
+
+    operations = [
+        migrations.RemoveField(model_name="usersummary", name="storage_bytes")
+    ]
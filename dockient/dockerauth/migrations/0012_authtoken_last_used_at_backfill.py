@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+# Tokens issued before usage was tracked may be in use. They count as used
+# when tracking started, so that TOKEN_IDLE_EXPIRY_DAYS does not expire them
+# right after the upgrade.
+def backfill_last_used_at(apps, schema_editor):
+    AuthToken = apps.get_model("dockerauth", "AuthToken")
+    now = timezone.now()
+    AuthToken.objects.filter(last_used_at__isnull=True, expires_at__gt=now).update(
+        last_used_at=now
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("dockerauth", "0011_usersummary_remove_storage_bytes")]
+
+    operations = [
+        migrations.RunPython(backfill_last_used_at, migrations.RunPython.noop)
+    ]
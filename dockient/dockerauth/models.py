@@ -1,10 +1,13 @@
-from django.db import models
-from django.db.models import F
+from django.db import models, transaction
+from django.db.models import Count, F, Min, Q, Value
+from django.db.models.functions import Coalesce, Least
 from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from .usage import TokenUsageTracker
+
 import datetime
 import secrets
 import pytz
@@ -15,6 +18,9 @@ DEFAULT_EXPIRY = datetime.timedelta(days=365)
 # Max number of simultaneously active tokens for a user
 MAX_ACTIVE_TOKENS = 5
 
+# Max number of credentials issued to a robot account in one call
+MAX_ROBOT_CREDENTIALS_PER_CALL = 1000
+
 
 class AuthException(Exception):
     pass
@@ -24,14 +30,18 @@ class AuthTokenManager(models.Manager):
     def authenticate(self, access_key, secret_access_key):
         try:
             now = timezone.now()
-            token = AuthToken.objects.select_related("user").get(
+            # Robot accounts are loaded along with the user,
+            # so that their scope can be checked without another query
+            token = AuthToken.objects.select_related("user", "user__robot").get(
                 access_key=access_key,
                 secret_access_key=secret_access_key,
                 expires_at__gt=now,
             )
-            return token.user
         except ObjectDoesNotExist as e:
             raise AuthException("Invalid credentials")
+        # Written later by the tracker, not on the request path
+        token_usage.record(token.pk, now)
+        return token.user
 
     def get_docker_login(self, user, expiry=DEFAULT_EXPIRY):
         """Generate a docker login command
@@ -46,18 +56,39 @@ class AuthTokenManager(models.Manager):
             access_key, secret_access_key, settings.ADVERTISED_URL
         )
 
-    def list_tokens(self, user):
+    def list_tokens(self, user, before=None, limit=None):
+        """Active tokens of the user, newest first
+
+        Pass the id of the last token of a page as `before` to get the next
+        page. Secrets are never loaded. Returns a list, so that the tokens
+        are fetched once no matter how many times the caller iterates them.
+        """
         now = timezone.now()
-        tokens = (
-            AuthToken.objects.filter(user=user, expires_at__gt=now)
-            .order_by("-created_at")
-            .values()
+        tokens = AuthToken.objects.filter(user=user, expires_at__gt=now)
+        if before is not None:
+            tokens = tokens.filter(id__lt=before)
+        tokens = tokens.order_by("-id").values(
+            "id", "user_id", "access_key", "created_at", "expires_at", "last_used_at"
         )
+        return list(tokens[:limit])
 
-        # Mask the tokens before returning
-        for token in tokens:
-            del token["secret_access_key"]
-        return tokens
+    def expire_idle(self, idle_days):
+        """Expires tokens that have not been used for `idle_days`
+
+        Tokens that were never used count as used when they were created.
+        Tokens issued before usage was tracked count as used when tracking
+        started, see migration 0012.
+        Returns the number of expired tokens.
+        """
+        now = timezone.now()
+        cutoff = now - datetime.timedelta(days=idle_days)
+        idle = AuthToken.objects.filter(expires_at__gt=now).filter(
+            Q(last_used_at__lt=cutoff)
+            | Q(last_used_at__isnull=True, created_at__lt=cutoff)
+        )
+        with transaction.atomic():
+            UserSummary.objects.tokens_changed(idle.values("user_id"))
+            return idle.update(expires_at=now)
 
     def delete_token(self, user, id):
         token = AuthToken.objects.get(id=id, user=user)
@@ -82,6 +113,35 @@ class AuthTokenManager(models.Manager):
         )
         return (access_key, secret_access_key)
 
+    def issue_robot_credentials(self, robot, count, expiry=DEFAULT_EXPIRY):
+        """Create `count` credentials for a robot account
+
+        Robot accounts are not limited to MAX_ACTIVE_TOKENS. The credentials
+        are inserted with a single bulk_create, in one transaction.
+        Returns a list of (access_key, secret_access_key)
+        """
+        if count < 1:
+            raise Exception("Cannot issue less than 1 credential")
+        if count > MAX_ROBOT_CREDENTIALS_PER_CALL:
+            raise Exception(
+                "Cannot issue more than %s credentials at once"
+                % MAX_ROBOT_CREDENTIALS_PER_CALL
+            )
+        expires_at = timezone.now() + expiry
+        tokens = [
+            AuthToken(
+                user=robot.user,
+                access_key=secrets.token_urlsafe(20),
+                secret_access_key=secrets.token_urlsafe(20),
+                expires_at=expires_at,
+            )
+            for _ in range(count)
+        ]
+        with transaction.atomic():
+            AuthToken.objects.bulk_create(tokens)
+            UserSummary.objects.tokens_added(robot.user_id, count, expires_at)
+        return [(token.access_key, token.secret_access_key) for token in tokens]
+
 
 # One user can have many AuthTokens
 # MAX_ACTIVE_TOKENS can be valid simultaneously
@@ -92,6 +152,15 @@ class AuthToken(models.Model):
     secret_access_key = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
+    # Updated in batches by token_usage, so it can lag behind by a few seconds
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+
+token_usage = TokenUsageTracker(
+    AuthToken,
+    batch_size=settings.TOKEN_USAGE_BATCH_SIZE,
+    interval=lambda: settings.TOKEN_USAGE_FLUSH_INTERVAL_SECONDS,
+)
 
 
 class Namespace(models.Model):
@@ -106,3 +175,280 @@ class NamespaceAccessRule(models.Model):
         max_length=10,
         choices=(("pull", "pull only"), ("push", "pull and push"), ("admin", "admin")),
     )
+
+
+class RobotAccountManager(models.Manager):
+    def create_robot(self, namespace, name, scope_namespaces, action):
+        """Create a robot account owned by `namespace`
+
+        The robot can perform `action` on the namespaces in `scope_namespaces`,
+        and nothing else. Every robot is backed by a user without a password,
+        which owns its credentials.
+        """
+        scope_namespaces = sorted(set(scope_namespaces))
+        existing = Namespace.objects.filter(name__in=scope_namespaces).values_list(
+            "name", flat=True
+        )
+        missing = set(scope_namespaces) - set(existing)
+        if missing:
+            raise Exception("Unknown namespaces " + ", ".join(sorted(missing)))
+
+        username = "robot+%s+%s" % (namespace.name, name)
+        max_length = get_user_model()._meta.get_field("username").max_length
+        if len(username) > max_length:
+            raise Exception(
+                "Robot username %s is longer than %s characters"
+                % (username, max_length)
+            )
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username=username)
+            return self.create(
+                user=user,
+                namespace=namespace,
+                name=name,
+                scope_namespaces=" ".join(scope_namespaces),
+                scope_action=action,
+            )
+
+
+# A non-human account, typically used by CI, with a fixed scope
+class RobotAccount(models.Model):
+    objects = RobotAccountManager()
+    user = models.OneToOneField(
+        get_user_model(), on_delete=models.CASCADE, related_name="robot"
+    )
+    namespace = models.ForeignKey(Namespace, on_delete=models.CASCADE)
+    name = models.CharField(max_length=50)
+    # Space separated names of the namespaces the robot can access
+    # Stored on the robot, so that checking its scope needs no extra query
+    scope_namespaces = models.TextField()
+    scope_action = models.CharField(
+        max_length=10, choices=(("pull", "pull only"), ("push", "pull and push"))
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("namespace", "name")
+
+    def can_access(self, namespace):
+        return namespace in self.scope_namespaces.split()
+
+
+# Every token issued by the token service is recorded here
+# Rows are written in batches by audit.AuditLogWriter, never on the request path
+# On postgres, the table is partitioned by day on issued_at, see audit.py
+class TokenAuditLog(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    jti = models.CharField(max_length=64)
+    # No foreign key constraint, the audit trail must outlive deleted users
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    username = models.CharField(max_length=150)
+    service = models.CharField(max_length=255)
+    scope = models.TextField()
+    granted_actions = models.CharField(max_length=100)
+    client_ip = models.GenericIPAddressField(null=True)
+    issued_at = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField()
+
+
+class GarbageCollectionWindowManager(models.Manager):
+    def active(self):
+        # A window past its deadline no longer freezes pushes,
+        # even if the command that opened it died before closing it
+        return self.filter(ended_at__isnull=True, deadline__gt=timezone.now())
+
+    def expire_stale(self):
+        return self.filter(ended_at__isnull=True, deadline__lte=timezone.now()).update(
+            status=GarbageCollectionWindow.TIMED_OUT, ended_at=timezone.now()
+        )
+
+
+# While a window is open, the token service refuses to grant push
+# so that registry garbage collection can run safely. See registrygc.py
+class GarbageCollectionWindow(models.Model):
+    DRAINING = "draining"
+    COLLECTING = "collecting"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+
+    objects = GarbageCollectionWindowManager()
+    status = models.CharField(
+        max_length=10,
+        choices=(
+            (DRAINING, "waiting for in-flight pushes"),
+            (COLLECTING, "garbage collection running"),
+            (COMPLETED, "completed"),
+            (FAILED, "failed"),
+            (TIMED_OUT, "timed out"),
+        ),
+        default=DRAINING,
+    )
+    started_at = models.DateTimeField(auto_now_add=True)
+    deadline = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True, db_index=True)
+    detail = models.TextField(blank=True)
+
+
+# Notifies a team's deploy system whenever an image is pushed to the namespace
+class WebhookSubscription(models.Model):
+    namespace = models.ForeignKey(Namespace, on_delete=models.CASCADE)
+    url = models.URLField(max_length=500)
+    active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+# The persistent queue of webhook calls, see webhooks.py
+# There is at most one pending delivery per subscription, repository and tag.
+# Further pushes to the same tag update its payload and bump its version.
+class WebhookDelivery(models.Model):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+    subscription = models.ForeignKey(WebhookSubscription, on_delete=models.CASCADE)
+    repository = models.CharField(max_length=255)
+    tag = models.CharField(max_length=128)
+    payload = models.TextField()
+    version = models.IntegerField(default=1)
+    status = models.CharField(
+        max_length=10,
+        choices=((PENDING, "pending"), (DELIVERED, "delivered"), (FAILED, "failed")),
+        default=PENDING,
+    )
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = (("status", "next_attempt_at"),)
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subscription", "repository", "tag"],
+                condition=models.Q(status="pending"),
+                name="one_pending_delivery_per_tag",
+            )
+        ]
+
+
+# Repositories and tags are recorded from registry push notifications,
+# see catalog.py. Only repositories under a known namespace are recorded
+class Repository(models.Model):
+    namespace = models.ForeignKey(Namespace, on_delete=models.CASCADE)
+    # The full name, including the namespace, like samalba/my-app
+    # On postgres, it is also indexed for substring search, see search.py
+    name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class Tag(models.Model):
+    repository = models.ForeignKey(Repository, on_delete=models.CASCADE)
+    name = models.CharField(max_length=128)
+    digest = models.CharField(max_length=100)
+    # The size of the manifest, as notified by the registry, not of the image
+    size = models.BigIntegerField(null=True)
+    pushed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("repository", "name")
+
+
+# Bytes of blobs pulled from each namespace, per hour, see bandwidth.py
+class NamespaceBandwidth(models.Model):
+    namespace = models.ForeignKey(Namespace, on_delete=models.CASCADE)
+    # The start of the hour, in UTC
+    hour = models.DateTimeField()
+    bytes_sent = models.BigIntegerField(default=0)
+    requests = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("namespace", "hour")
+
+
+# How far an access log was ingested. Log files are identified by a hash
+# of their first line, so that a file is still recognised once rotated,
+# renamed or compressed. The offset is in uncompressed bytes
+class LogIngestOffset(models.Model):
+    fingerprint = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=500)
+    offset = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class UserSummaryManager(models.Manager):
+    def for_user(self, user):
+        """Returns the summary of the user, computing it if needed
+
+        Token counts change as tokens expire, without any event. They are
+        recounted once the next token expiry has passed.
+        """
+        summary = self.filter(user=user).first()
+        if summary is None:
+            return self.rebuild(user)
+        if summary.tokens_expire_at and summary.tokens_expire_at <= timezone.now():
+            summary.active_tokens, summary.tokens_expire_at = self._count_tokens(user)
+            self.filter(pk=summary.pk).update(
+                active_tokens=summary.active_tokens,
+                tokens_expire_at=summary.tokens_expire_at,
+            )
+        return summary
+
+    def tokens_added(self, user_id, count, expires_at):
+        expires_at = Value(expires_at, output_field=models.DateTimeField())
+        self.filter(user_id=user_id).update(
+            active_tokens=F("active_tokens") + count,
+            tokens_expire_at=Least(
+                Coalesce("tokens_expire_at", expires_at), expires_at
+            ),
+        )
+
+    def tokens_changed(self, users):
+        # The token counts are recounted by for_user
+        self.filter(user__in=users).update(tokens_expire_at=timezone.now())
+
+    def rebuild(self, user):
+        active_tokens, tokens_expire_at = self._count_tokens(user)
+        owned = Namespace.objects.filter(owner=user).aggregate(
+            namespaces=Count("id", distinct=True),
+            repositories=Count("repository", distinct=True),
+        )
+        summary, _ = self.update_or_create(
+            user=user,
+            defaults={
+                "active_tokens": active_tokens,
+                "tokens_expire_at": tokens_expire_at,
+                "owned_namespaces": owned["namespaces"],
+                "shared_namespaces": NamespaceAccessRule.objects.filter(
+                    user=user
+                ).count(),
+                "repositories": owned["repositories"],
+            },
+        )
+        return summary
+
+    def _count_tokens(self, user):
+        tokens = AuthToken.objects.filter(
+            user=user, expires_at__gt=timezone.now()
+        ).aggregate(count=Count("id"), next_expiry=Min("expires_at"))
+        return tokens["count"], tokens["next_expiry"]
+
+
+# What the homepage shows about a user, kept up to date by the handlers in
+# summaries.py so that the homepage does not aggregate on every load
+class UserSummary(models.Model):
+    objects = UserSummaryManager()
+    user = models.OneToOneField(
+        get_user_model(), on_delete=models.CASCADE, primary_key=True
+    )
+    active_tokens = models.IntegerField(default=0)
+    # When the next active token expires
+    tokens_expire_at = models.DateTimeField(null=True)
+    owned_namespaces = models.IntegerField(default=0)
+    # Namespaces of other users the user has an access rule for
+    shared_namespaces = models.IntegerField(default=0)
+    # Repositories in owned namespaces
+    repositories = models.IntegerField(default=0)
@@ -0,0 +1,160 @@
+"""Evaluates the access policy of every user on every namespace at once
+
+Answering "who can push where" with ACL.resolve takes queries per user and
+namespace. Instead, a PolicySnapshot loads users, namespaces, access rules
+and robot accounts with one query each, and keeps one bitset per namespace
+and action, with one bit per user. Bit i stands for the i-th user by
+username, so a namespace's row of the matrix is a single integer, and
+snapshots stream their rows sorted by namespace and username.
+
+A snapshot can be exported to CSV, and two sorted streams of rows can be
+diffed in constant memory, whether they come from CSV or the database.
+"""
+from django.contrib.auth import get_user_model
+
+from .models import Namespace, NamespaceAccessRule, RobotAccount
+
+import csv
+
+NONE = "none"
+PULL = "pull"
+PUSH = "push"
+
+# The access granted by each NamespaceAccessRule action, see NamespaceAccess
+RULE_ACCESS = {"pull": PULL, "push": PUSH, "admin": PUSH}
+
+HEADER = ["namespace", "username", "access"]
+DIFF_HEADER = ["namespace", "username", "before", "after"]
+
+
+class PolicySnapshot:
+    """The access of every user on every namespace, as NamespaceAccess and
+    RobotScope would resolve it for repositories
+    """
+
+    def __init__(self, usernames, namespaces):
+        # Both sorted, usernames[i] is the user of bit i
+        self.usernames = usernames
+        self.namespaces = namespaces
+        self.pull = [0] * len(namespaces)
+        self.push = [0] * len(namespaces)
+
+    @classmethod
+    def load(cls):
+        users = sorted(get_user_model().objects.values_list("username", "id"))
+        namespaces = sorted(Namespace.objects.values_list("name", "id", "owner_id"))
+        snapshot = cls([u for u, _ in users], [n for n, _, _ in namespaces])
+
+        user_bits = dict((pk, 1 << i) for i, (_, pk) in enumerate(users))
+        namespace_index = dict((pk, i) for i, (_, pk, _) in enumerate(namespaces))
+        name_index = dict((name, i) for i, (name, _, _) in enumerate(namespaces))
+
+        # Owners have complete access
+        for i, (_, _, owner_id) in enumerate(namespaces):
+            snapshot.push[i] |= user_bits[owner_id]
+
+        for namespace_id, user_id, action in NamespaceAccessRule.objects.values_list(
+            "namespace_id", "user_id", "action"
+        ):
+            snapshot._grant(
+                namespace_index[namespace_id], user_bits[user_id], RULE_ACCESS[action]
+            )
+
+        # Robots only have access to their scope, see RobotScope
+        robots = list(
+            RobotAccount.objects.values_list(
+                "user_id", "scope_namespaces", "scope_action"
+            )
+        )
+        others = ~sum(user_bits[user_id] for user_id, _, _ in robots)
+        for i in range(len(namespaces)):
+            snapshot.push[i] &= others
+            snapshot.pull[i] &= others
+        for user_id, scope, action in robots:
+            for name in scope.split():
+                if name in name_index:
+                    snapshot._grant(name_index[name], user_bits[user_id], action)
+
+        # Whoever can push can pull
+        for i in range(len(namespaces)):
+            snapshot.pull[i] |= snapshot.push[i]
+        return snapshot
+
+    def _grant(self, namespace, bit, access):
+        if access == PUSH:
+            self.push[namespace] |= bit
+        else:
+            self.pull[namespace] |= bit
+
+    def count(self, access):
+        """Number of (user, namespace) pairs with at least `access`"""
+        rows = self.push if access == PUSH else self.pull
+        return sum(bin(row).count("1") for row in rows)
+
+    def rows(self, include_denied=False):
+        """Yields (namespace, username, access), sorted by namespace and username
+
+        Only users with access are included, unless `include_denied`.
+        """
+        for i, namespace in enumerate(self.namespaces):
+            pull, push = self.pull[i], self.push[i]
+            if include_denied:
+                for j, username in enumerate(self.usernames):
+                    yield namespace, username, _access(pull, push, 1 << j)
+            else:
+                for j in _set_bits(pull):
+                    yield namespace, self.usernames[j], _access(pull, push, 1 << j)
+
+
+def _access(pull, push, bit):
+    if push & bit:
+        return PUSH
+    if pull & bit:
+        return PULL
+    return NONE
+
+
+def _set_bits(n):
+    while n:
+        lowest = n & -n
+        yield lowest.bit_length() - 1
+        n ^= lowest
+
+
+def write_csv(rows, f):
+    writer = csv.writer(f)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+
+
+def read_csv(f):
+    """Yields the rows of a CSV written by write_csv"""
+    reader = csv.reader(f)
+    if next(reader, None) != HEADER:
+        raise ValueError("Not a policy snapshot, expected header " + ",".join(HEADER))
+    for namespace, username, access in reader:
+        yield namespace, username, access
+
+
+def diff(before, after):
+    """Yields (namespace, username, before, after) for every changed access
+
+    `before` and `after` are iterables of rows sorted by namespace and
+    username, like PolicySnapshot.rows or read_csv. They are merged as
+    they are read, so memory use does not depend on their size.
+    """
+    before, after = iter(before), iter(after)
+    old, new = next(before, None), next(after, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[:2] < new[:2]):
+            if old[2] != NONE:
+                yield old[0], old[1], old[2], NONE
+            old = next(before, None)
+        elif old is None or new[:2] < old[:2]:
+            if new[2] != NONE:
+                yield new[0], new[1], NONE, new[2]
+            new = next(after, None)
+        else:
+            if old[2] != new[2]:
+                yield old[0], old[1], old[2], new[2]
+            old, new = next(before, None), next(after, None)
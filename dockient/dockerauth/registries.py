@@ -0,0 +1,142 @@
+"""The registries served by this token service
+
+By default, the token service serves a single registry, configured with the
+TOKEN_SERVICE_* settings. To serve several registries, point
+TOKEN_SERVICE_REGISTRIES_FILE to a JSON file like
+
+    [
+        {
+            "service": "registry.eu.example.com",
+            "issuer": "tokenservice.eu.example.com",
+            "private_key_file": "/run/secrets/eu.pem",
+            "expiry_in_seconds": 604800,
+            "push_expiry_in_seconds": 900,
+            "namespaces": ["infra", "team-*"]
+        }
+    ]
+
+The `service` parameter of a token request, which becomes the audience of
+the token, selects the registry. Services that are not listed fall back to
+the default registry. `namespaces` is optional, and restricts the registry
+to the namespaces matching one of the names or glob patterns.
+
+The file is read once per process, and registries are looked up by service.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+import fnmatch
+import functools
+import json
+
+
+class Registry:
+    def __init__(
+        self,
+        service,
+        issuer,
+        private_key,
+        expiry_in_seconds,
+        push_expiry_in_seconds,
+        namespaces=None,
+    ):
+        self.service = service
+        self.issuer = issuer
+        self.private_key = private_key
+        self.expiry_in_seconds = expiry_in_seconds
+        self.push_expiry_in_seconds = push_expiry_in_seconds
+
+        # Plain names are looked up in a set, patterns are matched in order
+        self.all_namespaces = namespaces is None
+        self.namespace_names = set()
+        self.namespace_patterns = []
+        for namespace in namespaces or []:
+            if any(c in namespace for c in "*?["):
+                self.namespace_patterns.append(namespace)
+            else:
+                self.namespace_names.add(namespace)
+
+    def serves(self, namespace):
+        if self.all_namespaces:
+            return True
+        if namespace is None:
+            return False
+        if namespace in self.namespace_names:
+            return True
+        return any(
+            fnmatch.fnmatchcase(namespace, pattern)
+            for pattern in self.namespace_patterns
+        )
+
+
+def for_service(service):
+    registries, default = _load()
+    return registries.get(service, default)
+
+
+def max_push_expiry_in_seconds():
+    """The longest a push token issued for any registry stays valid"""
+    registries, default = _load()
+    return max(
+        registry.push_expiry_in_seconds
+        for registry in [default] + list(registries.values())
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _load():
+    default = Registry(
+        service=None,
+        issuer=settings.TOKEN_SERVICE_ISSUER,
+        private_key=settings.TOKEN_SERVICE_PRIVATE_KEY,
+        expiry_in_seconds=settings.TOKEN_SERVICE_EXPIRY_IN_SECONDS,
+        push_expiry_in_seconds=settings.TOKEN_SERVICE_PUSH_EXPIRY_IN_SECONDS,
+    )
+    if not settings.TOKEN_SERVICE_REGISTRIES_FILE:
+        return {}, default
+
+    try:
+        with open(settings.TOKEN_SERVICE_REGISTRIES_FILE) as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ImproperlyConfigured("Cannot read TOKEN_SERVICE_REGISTRIES_FILE: %s" % e)
+
+    registries = {}
+    for entry in entries:
+        try:
+            registry = _parse(entry, default)
+        except (KeyError, OSError) as e:
+            raise ImproperlyConfigured(
+                "Invalid registry %s in TOKEN_SERVICE_REGISTRIES_FILE: %s"
+                % (entry.get("service"), e)
+            )
+        if registry.service in registries:
+            raise ImproperlyConfigured("Duplicate registry " + registry.service)
+        registries[registry.service] = registry
+    return registries, default
+
+
+def _parse(entry, default):
+    if "private_key_file" in entry:
+        with open(entry["private_key_file"], "rb") as f:
+            private_key = f.read()
+    else:
+        private_key = entry["private_key"]
+    return Registry(
+        service=entry["service"],
+        issuer=entry.get("issuer", default.issuer),
+        private_key=private_key,
+        expiry_in_seconds=entry.get("expiry_in_seconds", default.expiry_in_seconds),
+        push_expiry_in_seconds=entry.get(
+            "push_expiry_in_seconds", default.push_expiry_in_seconds
+        ),
+        namespaces=entry.get("namespaces"),
+    )
+
+
+@receiver(setting_changed)
+def _reload(setting, **kwargs):
+    if setting.startswith("TOKEN_SERVICE_"):
+        _load.cache_clear()
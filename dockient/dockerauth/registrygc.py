@@ -0,0 +1,123 @@
+"""Coordinates registry garbage collection with the token service
+
+Garbage collection in registry:2 is only safe while nothing is being pushed.
+A garbage collection window goes through these steps:
+
+1. The window is opened. From then on, every worker refuses to grant push,
+   within PUSH_FREEZE_CACHE_SECONDS. Pulls continue as usual.
+2. Push tokens issued before the freeze are drained, by waiting until the
+   last of them expires. Push tokens are short lived for this reason.
+3. The garbage collection hook runs
+4. The window is closed and pushes are allowed again
+
+Every window has a deadline. Once it passes, pushes are allowed again even if
+the process running the window has died.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from .models import GarbageCollectionWindow
+from . import registries
+
+import contextlib
+import datetime
+import os
+import shlex
+import signal
+import subprocess
+import time
+
+# (checked_at, frozen) for this worker, see pushes_frozen
+_freeze_cache = (None, False)
+
+
+class GarbageCollectionError(Exception):
+    pass
+
+
+class GarbageCollectionTimeout(GarbageCollectionError):
+    pass
+
+
+def pushes_frozen():
+    """Returns True while a garbage collection window is open
+
+    This is on the path of every token request, so the answer is cached
+    in the worker for PUSH_FREEZE_CACHE_SECONDS.
+    """
+    global _freeze_cache
+    checked_at, frozen = _freeze_cache
+    now = time.monotonic()
+    if checked_at is None or now - checked_at >= settings.PUSH_FREEZE_CACHE_SECONDS:
+        frozen = GarbageCollectionWindow.objects.active().exists()
+        _freeze_cache = (now, frozen)
+    return frozen
+
+
+def open_window(timeout):
+    GarbageCollectionWindow.objects.expire_stale()
+    if GarbageCollectionWindow.objects.active().exists():
+        raise GarbageCollectionError("Another garbage collection window is open")
+    return GarbageCollectionWindow.objects.create(
+        deadline=timezone.now() + datetime.timedelta(seconds=timeout)
+    )
+
+
+def drain_pushes(window, sleep=time.sleep):
+    """Blocks until no push token issued before the freeze is valid
+
+    Workers notice the freeze within PUSH_FREEZE_CACHE_SECONDS, and the push
+    tokens they issued until then stay valid for up to the longest push
+    expiry of any registry. The audit log is not used to end the wait
+    earlier: it is best effort, entries may be dropped or still be buffered
+    by the workers, and missing one would let GC delete blobs of a push.
+    """
+    last_expiry = window.started_at + datetime.timedelta(
+        seconds=settings.PUSH_FREEZE_CACHE_SECONDS
+        + registries.max_push_expiry_in_seconds()
+    )
+    if last_expiry > window.deadline:
+        raise GarbageCollectionTimeout(
+            "In-flight push tokens expire after the window's deadline"
+        )
+    remaining = (last_expiry - timezone.now()).total_seconds()
+    if remaining > 0:
+        sleep(remaining)
+
+
+def run_hook(window, hook):
+    window.status = GarbageCollectionWindow.COLLECTING
+    window.save(update_fields=["status"])
+
+    timeout = max((window.deadline - timezone.now()).total_seconds(), 0)
+    # The hook runs in its own process group, so that everything it started
+    # is killed on timeout, not only the shell running it
+    process = subprocess.Popen(
+        shlex.split(hook),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+        env=dict(os.environ, REGISTRY_GC_TIMEOUT_SECONDS="%d" % timeout),
+    )
+    try:
+        stdout, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        raise GarbageCollectionTimeout("Garbage collection hook timed out")
+
+    output = stdout.decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        raise GarbageCollectionError(
+            "Garbage collection hook exited with status %s\n%s"
+            % (process.returncode, output)
+        )
+    return output
+
+
+def close_window(window, status, detail=""):
+    window.status = status
+    window.detail = detail
+    window.ended_at = timezone.now()
+    window.save(update_fields=["status", "detail", "ended_at"])
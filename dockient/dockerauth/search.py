@@ -0,0 +1,194 @@
+"""Substring search over repository names
+
+On postgres, repository names have a pg_trgm GIN index, so that icontains
+is answered from the index. Other databases would scan every name, so the
+search is answered from an in-process trigram index instead.
+
+Results are ordered by name and paginated by keyset: the next page starts
+after the last name of the previous page.
+
+Repositories are recorded from push notifications, see catalog.py. Images
+pushed before then are only found once the backfill_catalog command has
+read them from the registry.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Prefetch, Q, prefetch_related_objects
+
+from .models import Namespace, Repository, Tag
+
+import bisect
+import collections
+import threading
+import time
+
+NGRAM = 3
+
+# Sorts after any primary key, to position the keyset cursor after a name
+INFINITY = float("inf")
+
+
+class NgramIndex:
+    """Maps every trigram of a name to the ids of the names containing it
+
+    A query matches the intersection of the postings of its trigrams, which
+    is then checked for the full substring. Broad queries, including those
+    shorter than a trigram, walk the names in order from the keyset cursor
+    instead, and stop as soon as the page is full.
+    """
+
+    # Above this many candidates, walking the names in order is cheaper
+    # than sorting the candidates
+    MAX_SORTED_CANDIDATES = 5000
+
+    def __init__(self):
+        self.names = {}
+        self.postings = collections.defaultdict(set)
+        self.ordered = []
+        self.max_id = 0
+        self._dirty = False
+
+    def add(self, pk, name, namespace_id):
+        lowered = name.lower()
+        self.names[pk] = (name, lowered, namespace_id)
+        for gram in ngrams(lowered):
+            self.postings[gram].add(pk)
+        self.ordered.append((name, pk))
+        self.max_id = max(self.max_id, pk)
+        self._dirty = True
+
+    def search(self, query, namespace_ids, after, limit):
+        """Returns up to `limit` (name, pk) in `namespace_ids`, after `after`"""
+        if self._dirty:
+            self.ordered.sort()
+            self._dirty = False
+        query = query.lower()
+
+        def matches(pk):
+            _, lowered, namespace_id = self.names[pk]
+            return namespace_id in namespace_ids and query in lowered
+
+        grams = ngrams(query)
+        if grams:
+            postings = sorted(
+                (self.postings.get(gram, set()) for gram in grams), key=len
+            )
+            candidates = postings[0].intersection(*postings[1:])
+            if len(candidates) <= self.MAX_SORTED_CANDIDATES:
+                found = sorted(
+                    (self.names[pk][0], pk) for pk in candidates if matches(pk)
+                )
+                if after is not None:
+                    found = found[bisect.bisect_right(found, (after, INFINITY)) :]
+                return found[:limit]
+        else:
+            candidates = None
+
+        found = []
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(self.ordered, (after, INFINITY))
+        for i in range(start, len(self.ordered)):
+            name, pk = self.ordered[i]
+            if (candidates is None or pk in candidates) and matches(pk):
+                found.append((name, pk))
+                if len(found) == limit:
+                    break
+        return found
+
+
+def ngrams(text):
+    return set(text[i : i + NGRAM] for i in range(len(text) - NGRAM + 1))
+
+
+class _IndexCache:
+    # One index per worker, brought up to date before every search.
+    # New repositories are added incrementally, and the whole index is
+    # rebuilt every SEARCH_INDEX_REBUILD_SECONDS to drop deleted ones.
+
+    def __init__(self):
+        self.index = None
+        self.built_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            now = time.monotonic()
+            if (
+                self.index is None
+                or now - self.built_at >= settings.SEARCH_INDEX_REBUILD_SECONDS
+            ):
+                self.index = NgramIndex()
+                self.built_at = now
+            rows = (
+                Repository.objects.filter(id__gt=self.index.max_id)
+                .order_by("id")
+                .values_list("id", "name", "namespace_id")
+            )
+            for pk, name, namespace_id in rows.iterator():
+                self.index.add(pk, name, namespace_id)
+            return self.index
+
+
+_cache = _IndexCache()
+
+
+def readable_namespace_ids(user):
+    return set(
+        Namespace.objects.filter(Q(owner=user) | Q(namespaceaccessrule__user=user))
+        .values_list("id", flat=True)
+        .distinct()
+    )
+
+
+def search_repositories(user, query, after=None, limit=20):
+    """Finds repositories the user can read whose name contains `query`
+
+    A query like `app:v1` also filters tags by prefix, the matching tags are
+    set on each repository as `matching_tags`. Returns a list of repositories
+    and the cursor for the next page, or None if this is the last page.
+    """
+    repository_query, _, tag_query = query.strip().partition(":")
+    namespace_ids = readable_namespace_ids(user)
+    if not namespace_ids:
+        return [], None
+
+    repositories = Repository.objects.all()
+    if tag_query:
+        repositories = repositories.filter(tag__name__startswith=tag_query).distinct()
+
+    if connection.vendor == "postgresql":
+        repositories = repositories.filter(
+            namespace_id__in=namespace_ids, name__icontains=repository_query
+        )
+        if after:
+            repositories = repositories.filter(name__gt=after)
+        page = list(repositories.order_by("name")[: limit + 1])
+    else:
+        page = _search_in_process(
+            repositories, repository_query, namespace_ids, after, limit
+        )
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if tag_query:
+        tags = Tag.objects.filter(name__startswith=tag_query).order_by("-pushed_at")
+        prefetch_related_objects(
+            page, Prefetch("tag_set", queryset=tags, to_attr="matching_tags")
+        )
+    next_cursor = page[-1].name if has_more else None
+    return page, next_cursor
+
+
+def _search_in_process(repositories, query, namespace_ids, after, limit):
+    # Tag filters may discard matches, so keep fetching until the page is full
+    index = _cache.get()
+    page = []
+    while len(page) <= limit:
+        matches = index.search(query, namespace_ids, after, limit + 1)
+        if not matches:
+            break
+        found = repositories.in_bulk([pk for _, pk in matches])
+        page.extend(found[pk] for _, pk in matches if pk in found)
+        after = matches[-1][0]
+    return page[: limit + 1]
@@ -0,0 +1,104 @@
+"""Keeps every UserSummary up to date as the data it counts changes
+
+Each handler applies the change with a single UPDATE of F() increments, so
+concurrent changes do not overwrite each other and nothing is recounted.
+Handlers only update existing summaries; a missing summary is computed in
+full the next time it is read.
+
+Token counts are the exception: tokens also stop counting when they expire,
+so any change other than a new token only marks the counts as outdated,
+and they are recounted on the next read. QuerySet.update() and
+bulk_create() send no signals, code changing tokens that way must call
+UserSummary.objects.tokens_added or tokens_changed itself.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import AuthToken, Namespace, NamespaceAccessRule, Repository, UserSummary
+
+
+@receiver(post_save, sender=get_user_model())
+def _user_saved(sender, instance, created, raw=False, **kwargs):
+    # A new user has nothing to count yet
+    if created and not raw:
+        UserSummary.objects.create(user=instance)
+
+
+@receiver(post_save, sender=AuthToken)
+def _token_saved(sender, instance, created, **kwargs):
+    if created:
+        UserSummary.objects.tokens_added(instance.user_id, 1, instance.expires_at)
+    else:
+        UserSummary.objects.tokens_changed([instance.user_id])
+
+
+@receiver(post_delete, sender=AuthToken)
+def _token_deleted(sender, instance, **kwargs):
+    UserSummary.objects.tokens_changed([instance.user_id])
+
+
+@receiver(pre_save, sender=Namespace)
+def _namespace_changing(sender, instance, **kwargs):
+    instance._previous_owner_id = _previous(sender, instance, "owner_id")
+
+
+@receiver(post_save, sender=Namespace)
+def _namespace_saved(sender, instance, created, **kwargs):
+    previous = instance._previous_owner_id
+    if previous == instance.owner_id:
+        return
+    if previous is not None:
+        # Everything in the namespace changes hands, recount both owners
+        UserSummary.objects.filter(user__in=[previous, instance.owner_id]).delete()
+    else:
+        _add(instance.owner_id, owned_namespaces=1)
+
+
+@receiver(post_delete, sender=Namespace)
+def _namespace_deleted(sender, instance, **kwargs):
+    _add(instance.owner_id, owned_namespaces=-1)
+
+
+@receiver(post_save, sender=NamespaceAccessRule)
+def _rule_saved(sender, instance, created, **kwargs):
+    if created:
+        _add(instance.user_id, shared_namespaces=1)
+
+
+@receiver(post_delete, sender=NamespaceAccessRule)
+def _rule_deleted(sender, instance, **kwargs):
+    _add(instance.user_id, shared_namespaces=-1)
+
+
+@receiver(post_save, sender=Repository)
+def _repository_saved(sender, instance, created, **kwargs):
+    if created:
+        _add_to_owner(
+            Namespace.objects.filter(pk=instance.namespace_id), repositories=1
+        )
+
+
+@receiver(post_delete, sender=Repository)
+def _repository_deleted(sender, instance, **kwargs):
+    _add_to_owner(Namespace.objects.filter(pk=instance.namespace_id), repositories=-1)
+
+
+def _previous(sender, instance, field):
+    if instance.pk is None:
+        return None
+    return sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+def _add(user_id, **changes):
+    UserSummary.objects.filter(user_id=user_id).update(
+        **dict((field, F(field) + change) for field, change in changes.items())
+    )
+
+
+def _add_to_owner(namespaces, **changes):
+    # The owner is looked up in a subquery of the UPDATE
+    UserSummary.objects.filter(user_id__in=namespaces.values("owner_id")).update(
+        **dict((field, F(field) + change) for field, change in changes.items())
+    )
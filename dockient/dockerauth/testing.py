@@ -0,0 +1,96 @@
+"""Query budget assertions for tests of hot endpoints
+
+QueryBudgetMixin.assertQueryBudget runs a callable against seeded data of
+several sizes, and records the SQL queries and the wall time of each run.
+It fails when
+
+- the number of queries changes with the size of the data, which is
+  usually an N+1 query
+- the number of queries exceeds the declared budget
+- a run takes longer than the declared max_seconds
+
+The failure message lists the queries, grouped by their SQL with the
+parameters stripped, so that repeated queries stand out.
+"""
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+import collections
+import re
+import time
+
+DEFAULT_SIZES = (1, 10, 50)
+
+# Literals are replaced with ? to group queries that only differ by parameters
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class Measurement:
+    def __init__(self, size, queries, seconds):
+        self.size = size
+        self.queries = queries
+        self.seconds = seconds
+
+    @property
+    def num_queries(self):
+        return len(self.queries)
+
+
+def measure(seed, call, sizes=DEFAULT_SIZES):
+    """Returns a Measurement of `call` for every size
+
+    For each size, `seed(size)` creates the data and returns the arguments
+    for `call`. Each size runs in its own transaction that is rolled back.
+    """
+    measurements = []
+    for size in sizes:
+        with transaction.atomic():
+            args = seed(size)
+            if not isinstance(args, tuple):
+                args = (args,)
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                call(*args)
+                seconds = time.perf_counter() - start
+            measurements.append(
+                Measurement(size, [q["sql"] for q in context.captured_queries], seconds)
+            )
+            transaction.set_rollback(True)
+    return measurements
+
+
+def report(name, measurements, problem):
+    lines = ["%s: %s" % (name, problem), "", "    size  queries  ms"]
+    for m in measurements:
+        lines.append("%8d %8d  %.1f" % (m.size, m.num_queries, m.seconds * 1000))
+
+    largest = measurements[-1]
+    lines += ["", "Queries at size %s:" % largest.size]
+    grouped = collections.Counter(normalize(sql) for sql in largest.queries)
+    for sql, count in grouped.most_common():
+        lines.append("%6dx %s" % (count, sql))
+    return "\n".join(lines)
+
+
+def normalize(sql):
+    return LITERAL_PATTERN.sub("?", sql)
+
+
+class QueryBudgetMixin:
+    def assertQueryBudget(
+        self, name, seed, call, budget, max_seconds=None, sizes=DEFAULT_SIZES
+    ):
+        measurements = measure(seed, call, sizes)
+        counts = set(m.num_queries for m in measurements)
+        if len(counts) > 1:
+            self.fail(
+                report(
+                    name, measurements, "query count changes with the size of the data"
+                )
+            )
+        if max(counts) > budget:
+            self.fail(report(name, measurements, "more than %s queries" % budget))
+        slowest = max(measurements, key=lambda m: m.seconds)
+        if max_seconds is not None and slowest.seconds > max_seconds:
+            self.fail(report(name, measurements, "slower than %ss" % max_seconds))
+        return measurements
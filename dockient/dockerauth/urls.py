@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     url(r"^$", views.homepage, name="home"),
+    url(r"^search/$", views.search_repositories, name="search"),
     url(r"^accounts/login", views.login, name="login"),
     url(r"^accounts/logout", views.logout, name="logout"),
     url(
@@ -10,4 +11,6 @@ urlpatterns = [
         views.docker_registry_token_service,
         name="docker_registry_token_service",
     ),
+    url(r"^registry/events/", views.registry_events, name="registry_events"),
+    url(r"^metrics$", views.metrics, name="metrics"),
 ]
@@ -0,0 +1,61 @@
+"""Records when each AuthToken was last used, without a write per request
+
+Every successful authentication records the token's id and the time in a
+dict in the worker. Repeated uses of a token only keep the latest time, so
+the dict holds at most one entry per active token. A background thread
+writes the dict every TOKEN_USAGE_FLUSH_INTERVAL_SECONDS with one UPDATE
+per batch of tokens. The UPDATE never moves last_used_at backwards, as
+several workers flush the uses of the same token independently.
+
+When the database is unreachable, the uses that were not written are merged
+back into the dict, and written by a later flush.
+"""
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .writebehind import CONNECTION_ERRORS, WriteBehind
+
+import threading
+
+
+class TokenUsageTracker(WriteBehind):
+    def __init__(self, model, batch_size, interval):
+        super().__init__(interval)
+        self.model = model
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._last_used = {}
+
+    def record(self, token_id, used_at=None):
+        self._ensure_started()
+        with self._lock:
+            self._keep_latest(token_id, used_at or timezone.now())
+
+    def _keep_latest(self, token_id, used_at):
+        previous = self._last_used.get(token_id)
+        if previous is None or used_at > previous:
+            self._last_used[token_id] = used_at
+
+    def _drain(self):
+        with self._lock:
+            last_used, self._last_used = self._last_used, {}
+        return list(last_used.items())
+
+    def _write(self, items):
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start : start + self.batch_size]
+            used_at = Case(
+                *[When(pk=pk, then=Value(value)) for pk, value in batch],
+                output_field=DateTimeField()
+            )
+            try:
+                self.model.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+                    last_used_at=Greatest(Coalesce(F("last_used_at"), used_at), used_at)
+                )
+            except CONNECTION_ERRORS:
+                # Uses recorded since the drain may be more recent
+                with self._lock:
+                    for token_id, value in items[start:]:
+                        self._keep_latest(token_id, value)
+                raise
@@ -1,19 +1,33 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.http import HttpResponse, JsonResponse
 from django.contrib.auth import logout as django_logout
 from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
+from django.db import DatabaseError
 
-from .models import AuthToken, AuthException
+from .models import AuthToken, AuthException, TokenAuditLog, UserSummary
+from .acls import Request, RobotScope
+from . import audit, catalog, degraded, registries, registrygc, search, webhooks
 import re
 import base64
+import json
 import jwt
+import secrets
 import time
 
 BASIC_AUTH_HEADER_PATTERN = re.compile("Basic ([a-zA-Z0-9+/=_:-]+)")
 
+TOKENS_PER_PAGE = 20
+
+# Every action registry:2 checks, "*" grants all of them
+REGISTRY_ACTIONS = ("pull", "push", "delete", "*")
+
+# Longer services cannot be recorded in the audit log
+MAX_SERVICE_LENGTH = TokenAuditLog._meta.get_field("service").max_length
+
 
 def login(request):
     # This brings up google oauth consent screen
@@ -29,32 +43,123 @@ def logout(request):
 
 @login_required
 def homepage(request):
-    existing_tokens = AuthToken.objects.list_tokens(request.user)
-    context = {"user": request.user, "existing_tokens": existing_tokens}
+    # One more token than shown, to know whether there is a next page
+    existing_tokens = AuthToken.objects.list_tokens(
+        request.user,
+        before=_int_or_none(request.GET.get("before")),
+        limit=TOKENS_PER_PAGE + 1,
+    )
+    context = {
+        "user": request.user,
+        "summary": UserSummary.objects.for_user(request.user),
+        "existing_tokens": existing_tokens[:TOKENS_PER_PAGE],
+    }
+    if len(existing_tokens) > TOKENS_PER_PAGE:
+        context["next_cursor"] = existing_tokens[TOKENS_PER_PAGE - 1]["id"]
     if request.method == "POST":
         login_command = AuthToken.objects.get_docker_login(request.user)
         context["docker_login"] = login_command
     return render(request, "home.html", context=context)
 
 
+@login_required
+def search_repositories(request):
+    query = request.GET.get("q", "").strip()
+    context = {"query": query}
+    if query:
+        repositories, next_cursor = search.search_repositories(
+            request.user, query, after=request.GET.get("after")
+        )
+        context["repositories"] = repositories
+        context["next_cursor"] = next_cursor
+    return render(request, "search.html", context=context)
+
+
 # Intentionally disabled django @login_required
 #
 # This method is called by nginx whenever docker push / pull command is issued
 # This method should return status = 200 if the user is authorized to perform the action
 # Any other status code means nginx / docker registry should deny the action
 def docker_registry_token_service(request):
+    if len(request.GET.get("service", "")) > MAX_SERVICE_LENGTH:
+        return JsonResponse({"error": "Invalid service"}, status=400)
     try:
         basic_auth_header = request.headers.get("Authorization", None)
-        user = _authenticate(basic_auth_header)
-        service = request.GET["service"]
-        scope = request.GET["scope"]
-        token = _generate_jwt(user, service, scope)
+        token = None
+        if degraded.status.should_try_database():
+            try:
+                token = _issue_token(request, basic_auth_header)
+                degraded.status.recovered()
+            except DatabaseError:
+                degraded.status.database_down()
+        if token is None:
+            # The database is down, fall back to the local snapshot
+            token = _issue_token(
+                request, basic_auth_header, degraded.authenticate, from_snapshot=True
+            )
+            degraded.status.fell_back()
         return JsonResponse({"token": token.decode("ascii")})
     except AuthException as e:
         return JsonResponse({"error": str(e)}, status=401)
+    except degraded.SnapshotUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=503)
+
+
+def _issue_token(request, basic_auth_header, authenticate=None, from_snapshot=False):
+    user = _authenticate(basic_auth_header, authenticate)
+    service = request.GET["service"]
+    scope = request.GET["scope"]
+    return _generate_jwt(user, service, scope, _client_ip(request), from_snapshot)
+
 
+# Prometheus metrics of this worker, in the text exposition format
+# Scrapers send an "Authorization: Bearer <METRICS_TOKEN>" header
+def metrics(request):
+    if not _has_bearer_token(request, settings.METRICS_TOKEN):
+        return JsonResponse({"error": "Invalid metrics token"}, status=401)
+    snapshot_age = degraded.age()
+    lines = [
+        "# TYPE dockient_degraded gauge",
+        "dockient_degraded %d" % degraded.status.degraded,
+        "# TYPE dockient_degraded_tokens_total counter",
+        "dockient_degraded_tokens_total %d" % degraded.status.tokens_issued,
+        "# TYPE dockient_audit_log_dropped_total counter",
+        "dockient_audit_log_dropped_total %d" % audit.writer.dropped,
+        "# TYPE dockient_audit_log_rejected_total counter",
+        "dockient_audit_log_rejected_total %d" % audit.writer.rejected,
+    ]
+    if snapshot_age is not None:
+        lines += [
+            "# TYPE dockient_snapshot_age_seconds gauge",
+            "dockient_snapshot_age_seconds %.0f" % snapshot_age,
+        ]
+    return HttpResponse(
+        "\n".join(lines) + "\n", content_type="text/plain; version=0.0.4"
+    )
 
-def _authenticate(basic_auth_header):
+
+# Intentionally disabled django @login_required and csrf protection
+#
+# The registry posts a notification here whenever something is pushed
+# See https://docs.docker.com/registry/notifications/
+# Anything slow, like calling webhooks, happens later in the background
+@csrf_exempt
+@require_http_methods(["POST"])
+def registry_events(request):
+    if not _has_bearer_token(request, settings.REGISTRY_NOTIFICATION_TOKEN):
+        return JsonResponse({"error": "Invalid notification token"}, status=401)
+    try:
+        envelope = json.loads(request.body.decode("utf-8"))
+    except ValueError:
+        return JsonResponse({"error": "Invalid notification"}, status=400)
+
+    pushes = list(webhooks.tag_pushes(envelope))
+    catalog.record_pushes(pushes)
+    webhooks.enqueue(pushes)
+    return HttpResponse(status=200)
+
+
+def _authenticate(basic_auth_header, authenticate=None):
     if not basic_auth_header:
         raise AuthException("Empty Authorization Header")
     matcher = BASIC_AUTH_HEADER_PATTERN.match(basic_auth_header)
@@ -73,7 +178,30 @@ def _authenticate(basic_auth_header):
         raise AuthException("Basic auth header contains non-ascii symbols")
 
     username, password = username_and_password.split(":")
-    return AuthToken.objects.authenticate(username, password)
+    authenticate = authenticate or AuthToken.objects.authenticate
+    return authenticate(username, password)
+
+
+# Endpoints without a configured token are disabled
+def _has_bearer_token(request, token):
+    return bool(token) and secrets.compare_digest(
+        request.headers.get("Authorization", ""), "Bearer %s" % token
+    )
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# nginx forwards the real client's IP in X-Forwarded-For
+def _client_ip(request):
+    forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR")
 
 
 def authorize(user, service, scope):
@@ -89,28 +217,79 @@ def authorize(user, service, scope):
 #        "push", "pull"
 #   ]
 # }
+#
+# Actions the registry does not know are left out, they grant nothing
 def _parse_scope(scope):
     _type, name, raw_actions = scope.split(":")
-    if "," in raw_actions:
-        actions = raw_actions.split(",")
-    else:
-        actions = [raw_actions]
+    actions = []
+    for action in raw_actions.split(","):
+        if action in REGISTRY_ACTIONS and action not in actions:
+            actions.append(action)
     return {"type": _type, "name": name, "actions": actions}
 
 
-def _generate_jwt(user, service, scope):
+# repository names are like samalba/my-app, where samalba is the namespace
+# Names without a namespace, like ubuntu, don't belong to any namespace
+def _split_repository(name):
+    if "/" not in name:
+        return None, name
+    namespace, image = name.split("/", 1)
+    return namespace, image
+
+
+ROBOT_SCOPE = RobotScope()
+
+
+def _restrict_actions(user, registry, access):
+    namespace, image = _split_repository(access["name"])
+    if access["type"] == "repository" and not registry.serves(namespace):
+        return []
+    request = Request(user, access["type"], namespace, image, access["actions"])
+    if ROBOT_SCOPE.matches(request):
+        allowed = ROBOT_SCOPE.allowed_actions(request)
+        return [action for action in access["actions"] if action in allowed]
+    return access["actions"]
+
+
+def _grants_push(actions):
+    return "push" in actions or "*" in actions
+
+
+def _generate_jwt(user, service, scope, client_ip=None, from_snapshot=False):
+    # The service is the registry the token is for
+    registry = registries.for_service(service)
     access = _parse_scope(scope)
+    access["actions"] = _restrict_actions(user, registry, access)
+
+    # The database is down, only allow pulls, with short lived tokens
+    if from_snapshot:
+        access["actions"] = [a for a in access["actions"] if a == "pull"]
+
+    # Registry garbage collection is running, only allow pulls
+    # "*" grants every action to the registry, push included
+    if _grants_push(access["actions"]) and registrygc.pushes_frozen():
+        actions = [a for a in access["actions"] if a not in ("push", "*")]
+        if "*" in access["actions"] and "pull" not in actions:
+            actions.append("pull")
+        access["actions"] = actions
+
     # iat = issued at time
     iat = round(time.time())
 
     # nbf = not before. JWT is considered invalid before this time
     # provide a grace period of 60s for incorrect clock
     nbf = iat - 60
-    exp = iat + settings.TOKEN_SERVICE_EXPIRY_IN_SECONDS
+    if from_snapshot:
+        exp = iat + settings.DEGRADED_TOKEN_EXPIRY_IN_SECONDS
+    elif _grants_push(access["actions"]):
+        exp = iat + registry.push_expiry_in_seconds
+    else:
+        exp = iat + registry.expiry_in_seconds
 
-    jti = "some_random_string"
+    # jti = JWT ID, uniquely identifies this token in the audit log
+    jti = secrets.token_urlsafe(16)
     claims = {
-        "iss": settings.TOKEN_SERVICE_ISSUER,
+        "iss": registry.issuer,
         "sub": user.username,
         "aud": service,
         "exp": exp,
@@ -120,4 +299,8 @@ def _generate_jwt(user, service, scope):
         "access": access,
     }
 
-    return jwt.encode(claims, settings.TOKEN_SERVICE_PRIVATE_KEY, algorithm="RS256")
+    token = jwt.encode(claims, registry.private_key, algorithm="RS256")
+    audit.record_token(
+        jti, user, service, scope, access["actions"], client_ip, iat, exp
+    )
+    return token
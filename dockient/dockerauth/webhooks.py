@@ -0,0 +1,255 @@
+"""Delivers push notifications to per-namespace webhooks
+
+The registry notifies dockient of every push. Those notifications are turned
+into WebhookDelivery rows and acknowledged right away. The deliver_webhooks
+command sends them in the background:
+
+- HTTP calls run on a bounded pool of workers, and at most
+  WEBHOOK_MAX_PER_ENDPOINT calls run concurrently against one host. Free
+  slots are refilled as calls finish, so a slow host only delays itself
+- Failed deliveries are retried with exponential backoff, up to
+  WEBHOOK_MAX_ATTEMPTS, after which they are marked as failed
+- Pushes to a tag that still has a pending delivery update that delivery
+  instead of adding one, so that a burst of pushes results in one call
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import WebhookDelivery, WebhookSubscription
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import collections
+import concurrent.futures
+import datetime
+import json
+import urllib.request
+
+MANIFEST_MEDIA_TYPES = (
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+)
+
+
+def tag_pushes(envelope):
+    """Extracts pushes of tagged manifests from a registry notification
+
+    Blob pushes and pushes by digest are ignored. Yields dicts with the
+    repository, tag, digest and timestamp of each push.
+    """
+    for event in envelope.get("events", []):
+        target = event.get("target", {})
+        if event.get("action") != "push" or not target.get("tag"):
+            continue
+        if target.get("mediaType") not in MANIFEST_MEDIA_TYPES:
+            continue
+        yield {
+            "repository": target["repository"],
+            "tag": target["tag"],
+            "digest": target.get("digest"),
+            "size": target.get("size"),
+            "pushed_at": event.get("timestamp"),
+        }
+
+
+def enqueue(pushes):
+    """Queues a delivery for every subscription of the pushed namespaces
+
+    Pushes to the same tag within `pushes` are coalesced first,
+    the last one wins. Returns the number of new deliveries.
+    """
+    latest = collections.OrderedDict()
+    for push in pushes:
+        latest[(push["repository"], push["tag"])] = push
+    if not latest:
+        return 0
+
+    subscriptions = collections.defaultdict(list)
+    namespaces = set(_namespace_of(repository) for repository, _ in latest)
+    for subscription in WebhookSubscription.objects.filter(
+        namespace__name__in=namespaces, active=True
+    ).select_related("namespace"):
+        subscriptions[subscription.namespace.name].append(subscription)
+
+    created = 0
+    for (repository, tag), push in latest.items():
+        payload = json.dumps(dict(push, namespace=_namespace_of(repository)))
+        for subscription in subscriptions[_namespace_of(repository)]:
+            if _enqueue_one(subscription, repository, tag, payload):
+                created += 1
+    return created
+
+
+def _enqueue_one(subscription, repository, tag, payload):
+    pending = WebhookDelivery.objects.filter(
+        subscription=subscription,
+        repository=repository,
+        tag=tag,
+        status=WebhookDelivery.PENDING,
+    )
+    if pending.update(payload=payload, version=F("version") + 1):
+        return False
+    try:
+        with transaction.atomic():
+            WebhookDelivery.objects.create(
+                subscription=subscription,
+                repository=repository,
+                tag=tag,
+                payload=payload,
+                next_attempt_at=timezone.now(),
+            )
+        return True
+    except IntegrityError:
+        # Another worker queued this delivery in the meantime
+        pending.update(payload=payload, version=F("version") + 1)
+        return False
+
+
+def _namespace_of(repository):
+    return repository.split("/", 1)[0] if "/" in repository else None
+
+
+class Dispatcher:
+    """Sends deliveries on a bounded pool of worker threads
+
+    At most `per_endpoint` deliveries to the same host are in flight at once.
+    Slots are refilled as soon as deliveries finish, so a slow or dead
+    endpoint only holds its own slots and never delays other hosts.
+    Outcomes are recorded by the thread calling poll(), the workers only
+    make the HTTP calls.
+    """
+
+    def __init__(self, workers, per_endpoint, timeout):
+        self.workers = workers
+        self.per_endpoint = per_endpoint
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # Future of each delivery in flight, and deliveries in flight per host
+        self._in_flight = {}
+        self._per_endpoint = collections.Counter()
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    def poll(self, batch_size=100):
+        """Records finished deliveries, and starts due ones in the free slots
+
+        Returns the number of deliveries that finished.
+        """
+        finished = [future for future in self._in_flight if future.done()]
+        for future in finished:
+            delivery = self._in_flight.pop(future)
+            self._per_endpoint[_endpoint(delivery)] -= 1
+            _record_attempt(delivery, future.result())
+        self._start_due(batch_size)
+        return len(finished)
+
+    def wait(self, timeout=None):
+        """Blocks until a delivery finishes, for at most `timeout` seconds"""
+        if self._in_flight:
+            concurrent.futures.wait(
+                self._in_flight, timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _start_due(self, batch_size):
+        if len(self._in_flight) >= self.workers:
+            return
+        # Deliveries to hosts without a free slot are not even fetched,
+        # so that they can't fill every batch
+        full = [
+            delivery.subscription_id
+            for delivery in self._in_flight.values()
+            if self._per_endpoint[_endpoint(delivery)] >= self.per_endpoint
+        ]
+        due = (
+            WebhookDelivery.objects.filter(
+                status=WebhookDelivery.PENDING, next_attempt_at__lte=timezone.now()
+            )
+            .exclude(pk__in=[delivery.pk for delivery in self._in_flight.values()])
+            .exclude(subscription__in=full)
+            .select_related("subscription")
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        for delivery in due:
+            endpoint = _endpoint(delivery)
+            if self._per_endpoint[endpoint] >= self.per_endpoint:
+                continue
+            self._per_endpoint[endpoint] += 1
+            future = self._executor.submit(
+                self._post, delivery.subscription.url, delivery.payload
+            )
+            self._in_flight[future] = delivery
+            if len(self._in_flight) >= self.workers:
+                return
+
+    def _post(self, url, payload):
+        request = urllib.request.Request(
+            url,
+            data=payload.encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                return None
+        except Exception as e:
+            # Also malformed responses and URLs, which urllib does not wrap,
+            # so that one endpoint does not fail the whole batch
+            return str(e) or type(e).__name__
+
+
+def _endpoint(delivery):
+    return urlsplit(delivery.subscription.url).netloc
+
+
+def default_dispatcher():
+    return Dispatcher(
+        settings.WEBHOOK_WORKERS,
+        settings.WEBHOOK_MAX_PER_ENDPOINT,
+        settings.WEBHOOK_TIMEOUT_SECONDS,
+    )
+
+
+def deliver_due(dispatcher, batch_size=100):
+    """Sends deliveries until none is due, and records the outcomes
+
+    Only one process should deliver webhooks at a time.
+    Returns the number of deliveries that were attempted.
+    """
+    attempted = dispatcher.poll(batch_size)
+    while dispatcher.in_flight:
+        dispatcher.wait()
+        attempted += dispatcher.poll(batch_size)
+    return attempted
+
+
+def _record_attempt(delivery, error):
+    attempts = delivery.attempts + 1
+    if error is None:
+        # If the payload changed while it was being sent,
+        # the delivery stays pending and the latest payload is sent next time
+        WebhookDelivery.objects.filter(pk=delivery.pk, version=delivery.version).update(
+            status=WebhookDelivery.DELIVERED, attempts=attempts, last_error=""
+        )
+        return
+
+    if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+        changes = {"status": WebhookDelivery.FAILED}
+    else:
+        changes = {"next_attempt_at": timezone.now() + backoff(attempts)}
+    WebhookDelivery.objects.filter(pk=delivery.pk).update(
+        attempts=attempts, last_error=error, **changes
+    )
+
+
+def backoff(attempts):
+    seconds = settings.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(seconds, settings.WEBHOOK_RETRY_MAX_SECONDS))
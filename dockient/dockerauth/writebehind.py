@@ -0,0 +1,81 @@
+from django.db import InterfaceError, OperationalError, close_old_connections
+
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Errors that say nothing about the items, like the database being down.
+# Subclasses keep the items that failed with them, and write them again later
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+class WriteBehind:
+    """Buffers writes in memory and persists them from a background thread
+
+    Subclasses implement `_drain()`, which removes and returns everything
+    buffered so far, and `_write(items)`, which persists it in as few queries
+    as possible.
+
+    The flusher thread is started lazily on first use, so that it is created
+    in the gunicorn worker and not in the master process. An `interval` of 0
+    disables the thread; items are then only written when `flush()` is called.
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._pid = None
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    @property
+    def interval(self):
+        # Accept a callable so that the interval can come from settings
+        # which are only available after django has been configured
+        if callable(self._interval):
+            return self._interval()
+        return self._interval
+
+    def flush(self):
+        with self._flush_lock:
+            items = self._drain()
+            if items:
+                self._write(items)
+            return len(items)
+
+    def wakeup(self):
+        # Flush now instead of waiting for the interval to elapse
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid or not self.interval:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            thread = threading.Thread(
+                target=self._run, name=type(self).__name__, daemon=True
+            )
+            thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("%s failed to flush", type(self).__name__)
+
+    def _drain(self):
+        raise NotImplementedError()
+
+    def _write(self, items):
+        raise NotImplementedError()
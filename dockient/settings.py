@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import shlex
 from decouple import Csv
 from decouple import config
 from dj_database_url import parse as parse_db_url
@@ -81,6 +82,15 @@ DATABASE_URL = config(
     "DATABASE_URL", "sqlite:///" + os.path.join(BASE_DIR, "db.sqlite3")
 )
 DATABASES = {"default": parse_db_url(DATABASE_URL)}
+# Fail fast when the database is unreachable, so that the token service falls
+# back to its snapshot instead of waiting for the system's connect timeout
+DATABASE_CONNECT_TIMEOUT_SECONDS = config(
+    "DATABASE_CONNECT_TIMEOUT_SECONDS", default=3, cast=int
+)
+if "postgresql" in DATABASES["default"]["ENGINE"]:
+    DATABASES["default"].setdefault("OPTIONS", {})[
+        "connect_timeout"
+    ] = DATABASE_CONNECT_TIMEOUT_SECONDS
 
 
 AUTHENTICATION_BACKENDS = (
@@ -206,3 +216,78 @@ TOKEN_SERVICE_PRIVATE_KEY = config("TOKEN_SERVICE_PRIVATE_KEY", None)
 
 TOKEN_SERVICE_ISSUER = config("TOKEN_SERVICE_ISSUER", "tokenservice.metalaunch.com")
 TOKEN_SERVICE_EXPIRY_IN_SECONDS = 7 * 24 * 60 * 60
+
+# Issued tokens are recorded in an audit log by a background writer
+# Entries are buffered in memory, up to AUDIT_LOG_MAX_BUFFER, and written
+# in batches every AUDIT_LOG_FLUSH_INTERVAL_SECONDS
+AUDIT_LOG_FLUSH_INTERVAL_SECONDS = config(
+    "AUDIT_LOG_FLUSH_INTERVAL_SECONDS", default=5, cast=float
+)
+AUDIT_LOG_MAX_BUFFER = config("AUDIT_LOG_MAX_BUFFER", default=10000, cast=int)
+AUDIT_LOG_BATCH_SIZE = 500
+AUDIT_LOG_RETENTION_DAYS = config("AUDIT_LOG_RETENTION_DAYS", default=90, cast=int)
+
+# Tokens that grant push are short lived,
+# so that in-flight pushes can be drained before registry garbage collection
+TOKEN_SERVICE_PUSH_EXPIRY_IN_SECONDS = config(
+    "TOKEN_SERVICE_PUSH_EXPIRY_IN_SECONDS", default=15 * 60, cast=int
+)
+
+# Command that runs registry garbage collection, see bin/registry-gc.sh
+# It is killed, with every process it started, at the window's deadline
+REGISTRY_GC_HOOK = config(
+    "REGISTRY_GC_HOOK",
+    default=shlex.quote(os.path.join(BASE_DIR, "bin", "registry-gc.sh")),
+)
+REGISTRY_GC_TIMEOUT_IN_SECONDS = config(
+    "REGISTRY_GC_TIMEOUT_IN_SECONDS", default=60 * 60, cast=int
+)
+
+# Each worker checks for an open garbage collection window at most this often
+PUSH_FREEZE_CACHE_SECONDS = 5
+
+# The registry posts its notifications to /registry/events/
+# with an "Authorization: Bearer <REGISTRY_NOTIFICATION_TOKEN>" header
+REGISTRY_NOTIFICATION_TOKEN = config("REGISTRY_NOTIFICATION_TOKEN", None)
+
+# Webhooks are delivered by the deliver_webhooks command
+WEBHOOK_WORKERS = config("WEBHOOK_WORKERS", default=20, cast=int)
+WEBHOOK_MAX_PER_ENDPOINT = config("WEBHOOK_MAX_PER_ENDPOINT", default=4, cast=int)
+WEBHOOK_TIMEOUT_SECONDS = 10
+WEBHOOK_MAX_ATTEMPTS = 10
+WEBHOOK_RETRY_BASE_SECONDS = 30
+WEBHOOK_RETRY_MAX_SECONDS = 60 * 60
+
+# Without postgres, repository search uses an in-process index in each worker
+# It picks up new repositories on every search, and is rebuilt this often
+SEARCH_INDEX_REBUILD_SECONDS = 5 * 60
+
+# Optional JSON file describing several registries, see dockerauth/registries.py
+TOKEN_SERVICE_REGISTRIES_FILE = config("TOKEN_SERVICE_REGISTRIES_FILE", None)
+
+# When the database is unavailable, the token service authenticates against
+# a local snapshot, refreshed by the refresh_token_snapshot command, and only
+# issues short lived pull tokens. Degraded mode is disabled without a path
+DEGRADED_SNAPSHOT_FILE = config("DEGRADED_SNAPSHOT_FILE", None)
+DEGRADED_MAX_STALENESS_SECONDS = config(
+    "DEGRADED_MAX_STALENESS_SECONDS", default=6 * 60 * 60, cast=int
+)
+DEGRADED_TOKEN_EXPIRY_IN_SECONDS = 5 * 60
+# Once the database failed, each worker serves from the snapshot for this
+# long before trying the database again
+DEGRADED_RETRY_SECONDS = 30
+
+# /metrics requires an "Authorization: Bearer <METRICS_TOKEN>" header,
+# and is disabled without one, as nginx exposes it with the rest of the site
+METRICS_TOKEN = config("METRICS_TOKEN", None)
+
+# The time each token was last used is buffered by every worker,
+# and written in batches every TOKEN_USAGE_FLUSH_INTERVAL_SECONDS
+TOKEN_USAGE_FLUSH_INTERVAL_SECONDS = config(
+    "TOKEN_USAGE_FLUSH_INTERVAL_SECONDS", default=30, cast=float
+)
+TOKEN_USAGE_BATCH_SIZE = 500
+
+# The expire_idle_tokens command expires tokens unused for this many days
+# 0 disables it
+TOKEN_IDLE_EXPIRY_DAYS = config("TOKEN_IDLE_EXPIRY_DAYS", default=0, cast=int)